@@ -3,12 +3,24 @@ import pandas as pd
 import yfinance as yf
 import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'boto-s3-studies'))
+from functional_low_level import upload_dataframe, validate_dataframe_format
 
-def on_premise_ingestion(ticker_list):
+def on_premise_ingestion(ticker_list, client=None, bucket_name=None, object_name="data/financial_data.csv",
+                         file_format='csv', compression=None):
     """Ingest data on-premise from yfinance data sources
     :param ticker_list: list of strings
+    :param client: S3 Client used to connect with AWS. If given with bucket_name, the data
+        is uploaded straight from memory instead of being written to disk
+    :param bucket_name: string
+    :param object_name: string; the format and compression suffix is appended if missing
+    :param file_format: 'csv' or 'parquet', used by the upload
+    :param compression: Codec used by the upload: None, 'gzip', 'bz2', 'xz' or 'zstd' for CSV,
+        None, 'snappy', 'gzip', 'brotli', 'lz4' or 'zstd' for Parquet
     """
 
+    if client is not None and bucket_name is not None:
+        validate_dataframe_format(file_format, compression)
     financial_data = []
     for ticker in ticker_list:
         df = pd.DataFrame()
@@ -19,6 +31,11 @@ def on_premise_ingestion(ticker_list):
         print(f"Ingested data from ticker '{ticker}'")
         time.sleep(3)
     stacked_data = pd.concat(financial_data, axis=0)
+    if client is not None and bucket_name is not None:
+        if upload_dataframe(client, stacked_data, bucket_name, object_name, file_format=file_format,
+                            compression=compression) is None:
+            print(f"Couldn't upload the ingested data to bucket '{bucket_name}'")
+        return stacked_data
     directory = os.path.join(sys.path[0], "data")
     os.makedirs(directory, exist_ok=True)
     stacked_data.to_csv(f"{directory}/financial_data.csv")
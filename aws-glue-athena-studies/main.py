@@ -17,12 +17,16 @@ from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from iam_role_wrapper import attach_policy, create_role, list_policies, list_roles
 from s3_utils import check_if_bucket_exists, create_bucket, upload_data_to_bucket, nuke_bucket
-import boto3
 from glue_wrapper import GlueWrapper
 import json
 
 from boto3.exceptions import S3UploadFailedError
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'boto-s3-studies'))
+from client_factory import get_client
+from cost_ledger import get_cost_ledger, track_client, write_ledger
+from instrumentation import instrument_client, write_metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -200,13 +204,23 @@ if __name__ == "__main__":
     # S3 variables
     bucket_name = "dmsauto-nasdaq-raw"
     # Glue and S3 variables
-    glue = boto3.client('glue', region_name=region_name)
+    glue = get_client('glue', region_name=region_name)
     crawler_name = "crawler_dmsauto-nasdaq-raw__data"
     db_name = 'dmsauto-nasdaq-raw__data'
     role_arn='AWSGlueServiceRole-dmsauto-nasdaq'
     # Athena variables
-    athena = boto3.client('athena', region_name=region_name)
+    athena = get_client('athena', region_name=region_name)
     athena_bucket_name = 'dmsauto-nasdaq-athena'
+    # Opt-in per-call metrics, written at the end as Prometheus text ('.prom') or JSON
+    metrics_file = os.getenv('AWS_METRICS_FILE')
+    if metrics_file:
+        instrument_client(glue)
+        instrument_client(athena)
+    # Opt-in request and cost ledger of the run (Athena bytes scanned included), written at the end as JSON
+    ledger_file = os.getenv('AWS_COST_LEDGER_FILE')
+    if ledger_file:
+        track_client(glue)
+        track_client(athena)
     params = {
         'region': region_name,
         'database': db_name,
@@ -286,3 +300,10 @@ if __name__ == "__main__":
 
     delete_database(client=glue, name=db_name)
     delete_crawler(client=glue, name=crawler_name)
+
+    if metrics_file:
+        write_metrics(metrics_file)
+        print(f"API call metrics written to {metrics_file}")
+    if ledger_file:
+        print(get_cost_ledger().format_report())
+        write_ledger(ledger_file)
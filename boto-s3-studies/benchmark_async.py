@@ -0,0 +1,98 @@
+""" Benchmark comparing the operations per second of the threaded and the asyncio S3 paths.
+
+Both paths upload the same set of small files and then list them back, with the same
+concurrency. Each path creates its client and opens a connection before its timer starts,
+and only the successful operations are counted. The uploaded objects are deleted at the end.
+
+Usage: python benchmark_async.py <bucket_name> [--files 1000] [--size 4096] [--concurrency 64]
+"""
+
+#%%
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import functional_async
+from client_factory import get_client
+from functional_low_level import delete_objects_from_bucket, get_list_objects_in_bucket, upload_directory
+
+
+def create_sample_files(directory, file_count, file_size):
+    """Create file_count files of file_size random bytes in a directory
+
+    :param directory: string
+    :param file_count: int
+    :param file_size: int, bytes per file
+    :return: list of the created file paths
+    """
+
+    file_names = []
+    for i in range(file_count):
+        file_name = os.path.join(directory, f"sample_{i:06d}.bin")
+        with open(file_name, 'wb') as f:
+            f.write(os.urandom(file_size))
+        file_names.append(file_name)
+    return file_names
+
+
+def report(label, operations, seconds):
+    print(f"{label:<28} {operations:>8} ops in {seconds:8.2f}s = {operations / seconds:10.1f} ops/s")
+
+
+def run_threaded_benchmark(bucket_name, directory, concurrency):
+    """Upload the files of a directory, list them back and delete them with the threaded path"""
+
+    s3_client = get_client('s3', max_concurrency=concurrency)
+    # Open a connection before the timer starts, as the async path does
+    s3_client.head_bucket(Bucket=bucket_name)
+
+    start = time.perf_counter()
+    _, stats = upload_directory(s3_client, directory, bucket_name, prefix='benchmark/threads/',
+                                max_workers=concurrency)
+    report("threaded upload", stats['succeeded'], time.perf_counter() - start)
+
+    start = time.perf_counter()
+    keys = get_list_objects_in_bucket(s3_client, bucket_name, prefix='benchmark/threads/')
+    report("threaded list (keys)", len(keys), time.perf_counter() - start)
+
+    delete_objects_from_bucket(s3_client, bucket_name, keys)
+
+
+async def run_async_benchmark(bucket_name, file_names, concurrency):
+    """Upload the files, list them back and delete them with the asyncio path, on one client"""
+
+    async with functional_async.create_async_s3_client(max_pool_connections=concurrency) as client:
+        # Create the client and open a connection before the timer starts, as the threaded path does
+        await client.head_bucket(Bucket=bucket_name)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        start = time.perf_counter()
+        uploaded = await asyncio.gather(*(
+            functional_async.async_upload_file(client, semaphore, file_name, bucket_name,
+                                               f"benchmark/async/{os.path.basename(file_name)}")
+            for file_name in file_names))
+        report("async upload", sum(uploaded), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        keys = await functional_async.async_get_list_objects_in_bucket(client, bucket_name, prefix='benchmark/async/')
+        report("async list (keys)", len(keys), time.perf_counter() - start)
+
+        await functional_async.async_delete_objects_from_bucket(client, semaphore, bucket_name, keys)
+
+
+def run_benchmark(bucket_name, file_count, file_size, concurrency):
+    with tempfile.TemporaryDirectory() as directory:
+        file_names = create_sample_files(directory, file_count, file_size)
+        run_threaded_benchmark(bucket_name, directory, concurrency)
+        asyncio.run(run_async_benchmark(bucket_name, file_names, concurrency))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('bucket_name')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+    run_benchmark(args.bucket_name, args.files, args.size, args.concurrency)
@@ -0,0 +1,90 @@
+""" Benchmark of the cold import time of the listing path of functional_low_level.
+
+Each run starts a fresh interpreter that imports functional_low_level and looks up the
+listing functions, as a Lambda-style invocation would, and reports the wall-clock time
+of the import. Heavy dependencies (yfinance, pandas, pyarrow, boto3, ...) are imported
+lazily by the functions that need them, so the run also checks that none of them were
+loaded. The slowest modules of the last run are listed from python -X importtime.
+
+Creating the boto3 client is not part of the measurement: it is paid once by whoever
+creates the client (e.g., at Lambda initialization) and is shared through client_factory.
+
+Usage: python benchmark_import.py [--runs 10] [--threshold-ms 200] [--top 10]
+"""
+
+#%%
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ('yfinance', 'pandas', 'numpy', 'pyarrow', 'zstandard', 'boto3', 's3transfer', 'dotenv')
+
+CHILD_SCRIPT = f"""
+import sys, time
+start = time.perf_counter()
+from functional_low_level import get_list_objects_in_bucket, iter_objects_in_bucket
+elapsed = time.perf_counter() - start
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(elapsed, ','.join(loaded))
+"""
+
+
+def measure_import(directory):
+    """Import the listing path in a fresh interpreter
+
+    :param directory: Directory holding functional_low_level.py
+    :return: Tuple of (seconds, list of the heavy modules that were loaded)
+    """
+
+    output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT], cwd=directory, check=True,
+                            capture_output=True, text=True).stdout.split()
+    return float(output[0]), output[1].split(',') if len(output) > 1 else []
+
+
+def get_slowest_imports(directory, top=10):
+    """Run python -X importtime on the listing path
+
+    :param directory: Directory holding functional_low_level.py
+    :param top: Number of modules returned
+    :return: list of (cumulative microseconds, module name), slowest first
+    """
+
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import functional_low_level'],
+                            cwd=directory, check=True, capture_output=True, text=True).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative), name.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def run_benchmark(runs, threshold_ms, top):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        seconds, loaded = measure_import(directory)
+        timings.append(seconds * 1000)
+
+    median = statistics.median(timings)
+    print(f"Listing path import over {runs} cold runs: median {median:.1f} ms, "
+          f"min {min(timings):.1f} ms, max {max(timings):.1f} ms (threshold {threshold_ms} ms)")
+    print(f"Heavy modules loaded: {', '.join(loaded) or 'none'}")
+    print("Slowest imports (cumulative):")
+    for cumulative, name in get_slowest_imports(directory, top):
+        print(f"    {cumulative / 1000:8.1f} ms  {name}")
+    return median <= threshold_ms and not loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--threshold-ms', type=float, default=200.0)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.runs, args.threshold_ms, args.top) else 1)
@@ -0,0 +1,93 @@
+""" Shared, thread-safe factory of boto3 sessions and clients.
+
+Creating a boto3 client is expensive (it loads the service model and builds an HTTP
+connection pool) and each client defaults to max_pool_connections=10, which caps every
+concurrent transfer at 10 connections. This module caches one session per set of
+credentials and one client per service, region and pool size, with the connection pool
+sized to the concurrency that will use it and TCP keep-alive enabled, so every function
+reuses warm connections.
+
+Usage:
+    s3_client = get_client('s3', max_concurrency=64)
+    glue = get_client('glue', region_name='us-east-1')
+"""
+
+#%%
+import threading
+import boto3
+from botocore.config import Config
+from rate_limiter import register_rate_limiter
+
+
+DEFAULT_MAX_CONCURRENCY = 32
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+
+def get_session(aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, profile_name=None):
+    """Return the cached boto3 session for a set of credentials, creating it on first use
+
+    :param aws_access_key_id: string, or None to use the default credential chain
+    :param aws_secret_access_key: string
+    :param aws_session_token: string
+    :param profile_name: Name of a profile of the shared credentials file
+    :return: boto3.session.Session
+    """
+
+    session_key = (aws_access_key_id, aws_secret_access_key, aws_session_token, profile_name)
+    with _lock:
+        session = _sessions.get(session_key)
+        if session is None:
+            session = _sessions[session_key] = boto3.session.Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                aws_session_token=aws_session_token,
+                profile_name=profile_name)
+        return session
+
+
+def get_client(service_name, region_name=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, retries=None,
+               config_options=None, **credentials):
+    """Return the cached client of a service and region, creating it on first use
+
+    The connection pool holds max_concurrency connections, so up to that many threads can
+    use the client at the same time without waiting for a connection. Clients are
+    thread-safe and are meant to be shared. S3 clients are registered on the shared rate
+    limiter, which only throttles them once limits are configured.
+
+    :param service_name: e.g., 's3', 'glue' or 'athena'
+    :param region_name: String region, e.g., 'us-east-1'. If not specified, the session default is used
+    :param max_concurrency: Number of pooled HTTP connections
+    :param retries: botocore retry configuration, e.g., {'mode': 'standard', 'max_attempts': 10}.
+    If not specified, the botocore defaults (or the AWS_RETRY_MODE and AWS_MAX_ATTEMPTS
+    environment variables and the config file) apply
+    :param config_options: dict of extra botocore Config options (e.g., {'read_timeout': 120})
+    :param credentials: aws_access_key_id, aws_secret_access_key, aws_session_token or profile_name
+    :return: boto3 client
+    """
+
+    session = get_session(**credentials)
+    client_key = (service_name, region_name, max_concurrency, repr(sorted((retries or {}).items())),
+                  repr(sorted((config_options or {}).items())), id(session))
+    with _lock:
+        client = _clients.get(client_key)
+        if client is None:
+            options = {'max_pool_connections': max_concurrency, 'tcp_keepalive': True}
+            if retries is not None:
+                options['retries'] = retries
+            options.update(config_options or {})
+            client_config = Config(**options)
+            client = _clients[client_key] = session.client(service_name, region_name=region_name,
+                                                           config=client_config)
+            if service_name == 's3':
+                register_rate_limiter(client)
+        return client
+
+
+def clear_clients():
+    """Drop every cached client and session, e.g., after the credentials were rotated"""
+    with _lock:
+        _clients.clear()
+        _sessions.clear()
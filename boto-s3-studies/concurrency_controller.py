@@ -0,0 +1,208 @@
+""" AIMD concurrency controller driven by S3 SlowDown and throttling responses.
+
+Each key prefix gets a window of requests allowed in flight. Every successful request
+with a healthy latency grows the window additively (by about one request per window of
+completed requests), and every throttling response (503 SlowDown, 429, ...) shrinks it
+multiplicatively, at most once per round trip. Like TCP congestion control, the windows
+converge on the highest throughput each prefix sustains without being throttled.
+
+The controller hooks into the botocore events of a client, so every call made with that
+client (listing, uploads and downloads, including the parts of managed transfers, and
+deletions) waits for a free slot in the window of its prefix.
+
+Usage:
+    controller = register_adaptive_concurrency(s3_client)
+    ...
+    print(controller.get_metrics())
+"""
+
+#%%
+import threading
+import time
+
+
+THROTTLING_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                    'TooManyRequestsException', 'RequestThrottled', 'ProvisionedThroughputExceededException'}
+THROTTLING_STATUS_CODES = {429, 503}
+
+
+#########################################################
+# Single Window
+#########################################################
+
+class AIMDController:
+    """Additive-increase/multiplicative-decrease window of requests in flight
+
+    :param initial: Initial window
+    :param minimum: Smallest window, never reduced below
+    :param maximum: Largest window, e.g., the size of the connection pool
+    :param decrease: Factor applied to the window on throttling
+    :param latency_factor: Latency, relative to the lowest one observed, above which the window stops growing
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64, decrease=0.5, latency_factor=3.0):
+        self._condition = threading.Condition()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.window = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.latency_ewma = None
+        self.latency_baseline = None
+        self._last_decrease = 0.0
+        self._counters = {'successes': 0, 'throttles': 0, 'errors': 0, 'waits': 0}
+
+    def acquire(self):
+        """Wait for a free slot in the window and take it"""
+        with self._condition:
+            if self.in_flight >= int(self.window):
+                self._counters['waits'] += 1
+            while self.in_flight >= int(self.window):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, outcome, latency):
+        """Give a slot back and adapt the window to the outcome of its request
+
+        :param outcome: 'success', 'throttled' or 'error'
+        :param latency: Seconds the request took
+        """
+
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == 'throttled':
+                self._counters['throttles'] += 1
+                now = time.monotonic()
+                # A burst of throttles from one overloaded round trip only counts once
+                if now - self._last_decrease > (self.latency_ewma or 0.1):
+                    self.window = max(self.minimum, self.window * self.decrease)
+                    self._last_decrease = now
+            elif outcome == 'success':
+                self._counters['successes'] += 1
+                self.latency_ewma = latency if self.latency_ewma is None else 0.9 * self.latency_ewma + 0.1 * latency
+                self.latency_baseline = latency if self.latency_baseline is None \
+                    else min(self.latency_baseline, latency)
+                if self.latency_ewma <= self.latency_factor * self.latency_baseline:
+                    self.window = min(self.maximum, self.window + 1.0 / self.window)
+            else:
+                self._counters['errors'] += 1
+            self._condition.notify_all()
+
+    def get_metrics(self):
+        """Return the current window, requests in flight, latencies and outcome counters"""
+        with self._condition:
+            return dict(self._counters, window=self.window, in_flight=self.in_flight,
+                        latency_ewma=self.latency_ewma, latency_baseline=self.latency_baseline)
+
+
+#########################################################
+# Per-Prefix Controller
+#########################################################
+
+class PrefixConcurrencyController:
+    """One AIMDController per bucket and key prefix, fed by botocore client events
+
+    :param prefix_depth: Number of '/'-separated key levels that make up a prefix
+    :param controller_kwargs: Arguments of every AIMDController (initial, minimum, maximum, ...)
+    """
+
+    def __init__(self, prefix_depth=1, **controller_kwargs):
+        self.prefix_depth = prefix_depth
+        self.controller_kwargs = controller_kwargs
+        self._lock = threading.Lock()
+        self._controllers = {}
+        self._local = threading.local()
+
+    def get_controller(self, bucket, key=None):
+        """Return the controller of the prefix a key belongs to, creating it on first use"""
+        parts = (key or '').split('/')
+        prefix = '/'.join(parts[:self.prefix_depth]) + '/' if len(parts) > self.prefix_depth else ''
+        name = f"{bucket or ''}/{prefix}"
+        with self._lock:
+            controller = self._controllers.get(name)
+            if controller is None:
+                controller = self._controllers[name] = AIMDController(**self.controller_kwargs)
+            return controller
+
+    def get_metrics(self):
+        """Return the metrics of every prefix, keyed by 'bucket/prefix'"""
+        with self._lock:
+            controllers = dict(self._controllers)
+        return {name: controller.get_metrics() for name, controller in controllers.items()}
+
+    def register(self, client):
+        """Attach the controller to the events of an S3 client
+
+        :param client: boto3 S3 client
+        """
+
+        events = client.meta.events
+        unique_id = f"aimd-{id(self)}"
+        events.register('before-parameter-build.s3', self._before_parameter_build,
+                        unique_id=f"{unique_id}-before-parameter-build")
+        events.register('before-send.s3', self._before_send, unique_id=f"{unique_id}-before-send")
+        events.register('needs-retry.s3', self._needs_retry, unique_id=f"{unique_id}-needs-retry")
+        events.register('after-call-error.s3', self._after_call_error, unique_id=f"{unique_id}-after-call-error")
+
+    def _before_parameter_build(self, params, **kwargs):
+        self._local.controller = self.get_controller(params.get('Bucket'), params.get('Key') or params.get('Prefix'))
+
+    def _before_send(self, **kwargs):
+        controller = getattr(self._local, 'controller', None)
+        if controller is None:
+            return None
+        controller.acquire()
+        self._local.acquired = (controller, time.monotonic())
+        return None
+
+    def _release(self, outcome):
+        acquired = getattr(self._local, 'acquired', None)
+        if acquired is not None:
+            controller, start = acquired
+            self._local.acquired = None
+            controller.release(outcome, time.monotonic() - start)
+
+    def _needs_retry(self, response=None, caught_exception=None, **kwargs):
+        if caught_exception is not None or response is None:
+            self._release('error')
+            return None
+        http_response, parsed = response
+        code = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+        if code in THROTTLING_CODES or http_response.status_code in THROTTLING_STATUS_CODES:
+            self._release('throttled')
+        elif http_response.status_code >= 500:
+            self._release('error')
+        else:
+            self._release('success')
+        return None
+
+    def _after_call_error(self, **kwargs):
+        self._release('error')
+
+
+_controller = None
+
+
+def get_concurrency_controller():
+    """Return the controller shared by the process, or None if none was registered"""
+    return _controller
+
+
+def register_adaptive_concurrency(client, prefix_depth=1, **controller_kwargs):
+    """Register the shared controller on an S3 client, creating it on first use
+
+    The window of each prefix is capped by the connection pool of the client by default.
+
+    :param client: boto3 S3 client
+    :param prefix_depth: Number of '/'-separated key levels that make up a prefix
+    :param controller_kwargs: Arguments of every AIMDController (initial, minimum, maximum, ...)
+    :return: The shared PrefixConcurrencyController
+    """
+
+    global _controller
+    if _controller is None:
+        controller_kwargs.setdefault('maximum', client.meta.config.max_pool_connections)
+        _controller = PrefixConcurrencyController(prefix_depth=prefix_depth, **controller_kwargs)
+    _controller.register(client)
+    return _controller
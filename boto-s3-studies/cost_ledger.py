@@ -0,0 +1,312 @@
+""" Ledger of AWS API requests and their estimated cost for a pipeline run.
+
+Once a client is tracked, every API call it makes is counted by billing class (S3
+PUT/COPY/POST/LIST requests, S3 GET and other requests, free requests, Glue Data
+Catalog requests), with the bytes sent and received and, for Athena, the bytes scanned
+by every finished query. The ledger prices the run with a configurable price list
+(S3 Standard and Athena in us-east-1 by default) and flags redundant calls: read-only
+calls repeated with exactly the same parameters, grouped by the line of code that
+issued them, so request-saving changes can be measured run against run. That line is
+found outside the helper modules (a ListObjectsV2 repeated by usage_demo is reported on
+the usage_demo line, not inside get_list_objects_in_bucket), and calls made on the
+worker threads of a CallSiteExecutor are reported where the task was submitted.
+
+Usage:
+    track_client(s3_client)
+    usage_demo()
+    print(get_cost_ledger().format_report())
+"""
+
+#%%
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from file_utils import write_atomically
+
+
+# USD, per request or per byte scanned
+DEFAULT_PRICES = {
+    's3_put_list': 0.005 / 1000,
+    's3_get': 0.0004 / 1000,
+    's3_free': 0.0,
+    'glue_catalog': 1.0 / 1000000,
+    'athena': 0.0,
+    'other': 0.0,
+    'athena_scanned_byte': 5.0 / 1024 ** 4,
+}
+ATHENA_MIN_SCANNED_BYTES = 10 * 1024 ** 2
+
+S3_PUT_LIST_PREFIXES = ('Put', 'Copy', 'Create', 'Complete', 'List', 'Upload', 'Post', 'Restore', 'Select')
+S3_FREE_PREFIXES = ('Delete', 'Abort')
+# Operations that do not change any state; repeating one with the same parameters is redundant
+READ_ONLY_PREFIXES = ('Get', 'Head', 'List', 'Describe', 'Search', 'Select')
+
+# Frames of these packages are skipped when looking for the code that issued a call
+LIBRARY_PATHS = tuple(f"{os.sep}{package}{os.sep}" for package in (
+    'botocore', 'boto3', 's3transfer', 'aiobotocore', 'concurrent', 'asyncio', 'urllib3'))
+# Modules whose functions wrap API calls; their frames are skipped too, except the demonstrations
+HELPER_MODULES = ('functional_low_level', 'functional_async', 'object_cache')
+DEMO_FUNCTIONS = ('usage_demo',)
+
+_submitted_from = threading.local()
+
+
+def get_billing_class(service, operation):
+    """Return the billing class of an API operation
+
+    :param service: Hyphenized service id, e.g., 's3', 'glue' or 'athena'
+    :param operation: Operation name, e.g., 'ListObjectsV2'
+    :return: A key of DEFAULT_PRICES
+    """
+
+    if service == 's3':
+        if operation.startswith(S3_FREE_PREFIXES):
+            return 's3_free'
+        if operation.startswith(S3_PUT_LIST_PREFIXES):
+            return 's3_put_list'
+        return 's3_get'
+    if service == 'glue':
+        return 'glue_catalog'
+    if service == 'athena':
+        return 'athena'
+    return 'other'
+
+
+def _is_caller_frame(frame):
+    """Tell whether a frame belongs to the code using the helpers, rather than to a library or helper"""
+    filename = frame.f_code.co_filename
+    if filename == __file__ or any(path in filename for path in LIBRARY_PATHS) \
+            or filename.endswith(f"{os.sep}threading.py"):
+        return False
+    module = os.path.splitext(os.path.basename(filename))[0]
+    return module not in HELPER_MODULES or frame.f_code.co_name in DEMO_FUNCTIONS
+
+
+def _get_call_site():
+    """Return 'file:line (function)' of the innermost frame outside the libraries, helpers and this module
+
+    On a worker thread, whose stack only holds the task, the call site captured when the
+    task was submitted to a CallSiteExecutor is returned instead.
+    """
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        if _is_caller_frame(frame):
+            return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return getattr(_submitted_from, 'call_site', None) or "<managed transfer>"
+
+
+def _run_from_call_site(call_site, fn, *args, **kwargs):
+    previous = getattr(_submitted_from, 'call_site', None)
+    _submitted_from.call_site = call_site
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _submitted_from.call_site = previous
+
+
+class CallSiteExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks report their API calls on the line that submitted them
+
+    The call site is captured on the submitting thread by submit (and so by map), and
+    nested executors pass it on to their own tasks.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(_run_from_call_site, _get_call_site(), fn, *args, **kwargs)
+
+
+def _get_signature(operation, params):
+    """Hash an operation and its parameters; bodies are left out"""
+    params = {name: value for name, value in params.items() if name != 'Body'}
+    serialized = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(f"{operation}:{serialized}".encode()).hexdigest()
+
+
+class CostLedger:
+    """Thread-safe ledger of API calls, fed by the botocore events of tracked clients
+
+    :param prices: dict overriding entries of DEFAULT_PRICES
+    """
+
+    def __init__(self, prices=None):
+        self.prices = dict(DEFAULT_PRICES, **(prices or {}))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Forget every recorded call"""
+        with self._lock:
+            self._requests = Counter()
+            self._operations = Counter()
+            self._bytes_sent = 0
+            self._bytes_received = 0
+            self._athena_queries = {}
+            self._signatures = Counter()
+            self._redundant_calls = Counter()
+            self._redundant_cost = Counter()
+
+    #########################################################
+    # Event Handlers
+    #########################################################
+
+    def register(self, client):
+        """Register the event handlers on a client
+
+        :param client: boto3 client of any service
+        """
+
+        service_id = client.meta.service_model.service_id.hyphenize()
+        events = client.meta.events
+        unique_id = f"cost-ledger-{id(self)}"
+        events.register(f'before-parameter-build.{service_id}', self._before_parameter_build,
+                        unique_id=f"{unique_id}-before-parameter-build")
+        events.register(f'before-send.{service_id}', self._before_send, unique_id=f"{unique_id}-before-send")
+        events.register(f'after-call.{service_id}', self._after_call, unique_id=f"{unique_id}-after-call")
+
+    def _before_parameter_build(self, params, model, context, **kwargs):
+        context['cost_ledger_call_site'] = _get_call_site()
+        context['cost_ledger_signature'] = _get_signature(model.name, params)
+        self._local.bytes_sent = 0
+
+    def _before_send(self, request, **kwargs):
+        self._local.bytes_sent = getattr(self._local, 'bytes_sent', 0) + \
+            int(request.headers.get('Content-Length', 0) or 0)
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        service = model.service_model.service_id.hyphenize()
+        billing_class = get_billing_class(service, model.name)
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0) if isinstance(parsed, dict) else 0
+        bytes_sent = getattr(self._local, 'bytes_sent', 0)
+        self._local.bytes_sent = 0
+        # The Content-Length of a HEAD response describes the object, not a body
+        bytes_received = 0 if model.http.get('method') == 'HEAD' else \
+            int(http_response.headers.get('Content-Length', 0) or 0)
+        signature = context.get('cost_ledger_signature')
+        call_site = context.get('cost_ledger_call_site', "<unknown>")
+
+        with self._lock:
+            # Every attempt is a billed request
+            self._requests[billing_class] += 1 + retries
+            self._operations[f"{service}.{model.name}"] += 1 + retries
+            self._bytes_sent += bytes_sent
+            self._bytes_received += bytes_received
+            if signature is not None and model.name.startswith(READ_ONLY_PREFIXES):
+                self._signatures[signature] += 1
+                if self._signatures[signature] > 1:
+                    site = f"{service}.{model.name} @ {call_site}"
+                    self._redundant_calls[site] += 1
+                    self._redundant_cost[site] += self.prices.get(billing_class, 0.0)
+            if service == 'athena' and model.name == 'GetQueryExecution' and isinstance(parsed, dict):
+                self._record_athena_query(parsed.get('QueryExecution', {}))
+
+    def _record_athena_query(self, query_execution):
+        """Keep the bytes scanned of a finished query; must be called with the lock held"""
+        state = query_execution.get('Status', {}).get('State')
+        if state in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
+            scanned = query_execution.get('Statistics', {}).get('DataScannedInBytes', 0)
+            self._athena_queries[query_execution.get('QueryExecutionId')] = scanned
+
+    #########################################################
+    # Output
+    #########################################################
+
+    def get_summary(self):
+        """Return the requests, bytes and estimated cost of the run
+
+        :return: JSON-serializable dict with 'requests' (by billing class), 'operations',
+        'bytes_sent', 'bytes_received', 'athena_queries', 'athena_bytes_scanned', 'cost' (USD
+        by billing class) and 'total_cost'
+        """
+
+        with self._lock:
+            requests = dict(self._requests)
+            operations = dict(self._operations.most_common())
+            athena_scanned = list(self._athena_queries.values())
+            summary = {'bytes_sent': self._bytes_sent, 'bytes_received': self._bytes_received}
+
+        cost = {billing_class: count * self.prices.get(billing_class, 0.0)
+                for billing_class, count in requests.items()}
+        # Athena bills whole megabytes, with a 10 MB minimum per query that scanned data
+        billed_bytes = sum(max(math.ceil(scanned / 1024 ** 2) * 1024 ** 2, ATHENA_MIN_SCANNED_BYTES)
+                           for scanned in athena_scanned if scanned)
+        cost['athena_scanned'] = billed_bytes * self.prices['athena_scanned_byte']
+        summary.update({
+            'requests': requests,
+            'operations': operations,
+            'athena_queries': len(athena_scanned),
+            'athena_bytes_scanned': sum(athena_scanned),
+            'cost': cost,
+            'total_cost': sum(cost.values()),
+        })
+        return summary
+
+    def get_redundant_call_sites(self, top=10):
+        """Return the call sites that repeated read-only calls with identical parameters
+
+        :param top: Number of call sites returned
+        :return: list of dicts with 'call_site', 'redundant_calls' and 'cost', most redundant first
+        """
+
+        with self._lock:
+            return [{'call_site': site, 'redundant_calls': count, 'cost': self._redundant_cost[site]}
+                    for site, count in self._redundant_calls.most_common(top)]
+
+    def format_report(self, top=10):
+        """Render the summary and the top redundant call sites as text
+
+        :param top: Number of redundant call sites listed
+        :return: string
+        """
+
+        summary = self.get_summary()
+        lines = ["Requests by billing class:"]
+        for billing_class, count in sorted(summary['requests'].items()):
+            lines.append(f"    {billing_class:<16} {count:>10}  ${summary['cost'][billing_class]:.6f}")
+        lines.append(f"Bytes sent/received: {summary['bytes_sent']}/{summary['bytes_received']}")
+        lines.append(f"Athena: {summary['athena_queries']} queries scanned {summary['athena_bytes_scanned']} "
+                     f"bytes  ${summary['cost']['athena_scanned']:.6f}")
+        lines.append(f"Estimated total cost: ${summary['total_cost']:.6f}")
+        redundant = self.get_redundant_call_sites(top)
+        if redundant:
+            lines.append("Top redundant call sites:")
+            for entry in redundant:
+                lines.append(f"    {entry['redundant_calls']:>6} x {entry['call_site']}  ${entry['cost']:.6f}")
+        return "\n".join(lines)
+
+
+_ledger = CostLedger()
+
+
+def get_cost_ledger():
+    """Return the ledger shared by the process"""
+    return _ledger
+
+
+def track_client(client):
+    """Record the calls of a client in the shared ledger
+
+    :param client: boto3 client of any service, e.g., S3, Glue or Athena
+    :return: The same client, for chaining
+    """
+
+    _ledger.register(client)
+    return client
+
+
+def write_ledger(path, top=10):
+    """Write the summary and the top redundant call sites of the shared ledger as JSON, replacing it atomically
+
+    :param path: string
+    :param top: Number of redundant call sites written
+    """
+
+    content = dict(_ledger.get_summary(), redundant_call_sites=_ledger.get_redundant_call_sites(top))
+    write_atomically(path, json.dumps(content, indent=4))
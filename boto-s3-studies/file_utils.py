@@ -0,0 +1,20 @@
+""" File helpers shared by the S3 study modules.
+"""
+
+#%%
+import os
+
+
+def write_atomically(path, content):
+    """Replace a text file atomically, so a crash or a concurrent reader never sees it half written
+
+    The content is written to a temporary file next to path and renamed over it.
+
+    :param path: string
+    :param content: string
+    """
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, path)
@@ -0,0 +1,255 @@
+""" Python script with asyncio counterparts of the S3 functionalities from functional_low_level.
+
+The functions share a single aiobotocore client, whose connection pool is sized by
+max_pool_connections, and an asyncio.Semaphore bounding the number of requests in
+flight. This lets thousands of small operations (listing, uploading, downloading and
+deleting objects) run on one event loop instead of one thread per request.
+
+The synchronous functions at the end of the script are thin wrappers that run a batch
+on a fresh event loop, for callers that are not async themselves.
+"""
+
+#%%
+import asyncio
+import logging
+import os
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+#########################################################
+# Client
+#########################################################
+
+def create_async_s3_client(region_name=None, max_pool_connections=64, **client_kwargs):
+    """Create an aiobotocore S3 client, to be used with 'async with'
+
+    :param region_name: String region of the client, e.g., 'us-west-2'
+    :param max_pool_connections: Size of the HTTP connection pool shared by every request
+    :param client_kwargs: Extra arguments for create_client, e.g., aws_access_key_id
+    :return: Async context manager yielding the client
+    """
+
+    session = get_session()
+    config = AioConfig(max_pool_connections=max_pool_connections, tcp_keepalive=True)
+    return session.create_client('s3', region_name=region_name, config=config, **client_kwargs)
+
+
+#########################################################
+# Listing
+#########################################################
+
+async def async_iter_objects_in_bucket(client, bucket_name, prefix=None, start_after=None, page_size=1000):
+    """Lazily iterate over the objects in a bucket, following continuation tokens
+
+    :param client: Async S3 client from create_async_s3_client
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param start_after: Only list keys that sort after this key
+    :param page_size: Maximum number of keys per request
+    :return: Async generator of object dicts (Key, Size, ETag, LastModified, ...)
+    """
+
+    kwargs = {'Bucket': bucket_name, 'PaginationConfig': {'PageSize': page_size}}
+    if prefix:
+        kwargs['Prefix'] = prefix
+    if start_after:
+        kwargs['StartAfter'] = start_after
+
+    paginator = client.get_paginator('list_objects_v2')
+    async for page in paginator.paginate(**kwargs):
+        for content in page.get('Contents', []):
+            yield content
+
+
+async def async_get_list_objects_in_bucket(client, bucket_name, prefix=None):
+    """Retrieve the list of objects in a bucket
+
+    :param client: Async S3 client from create_async_s3_client
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :return: List of objects in the bucket
+    """
+
+    return [content['Key'] async for content in async_iter_objects_in_bucket(client, bucket_name, prefix=prefix)]
+
+
+#########################################################
+# Upload
+#########################################################
+
+async def async_upload_file(client, semaphore, file_name, bucket, object_name=None):
+    """Upload a file to an S3 bucket with a single PutObject
+
+    Intended for the many small files case; large files are better served by the managed
+    multipart transfer of functional_low_level.upload_file.
+
+    :param client: Async S3 client from create_async_s3_client
+    :param semaphore: asyncio.Semaphore bounding the requests in flight
+    :param file_name: File to upload
+    :param bucket: Bucket to upload to
+    :param object_name: S3 object name. If not specified then file_name is used
+    :return: True if file was uploaded, else False
+    """
+
+    if object_name is None:
+        object_name = os.path.basename(file_name)
+
+    try:
+        async with semaphore:
+            body = await asyncio.to_thread(_read_file, file_name)
+            await client.put_object(Bucket=bucket, Key=object_name, Body=body)
+        return True
+    except (BotoCoreError, ClientError, OSError) as e:
+        logging.error(e)
+        return False
+
+
+def _read_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+#########################################################
+# Download
+#########################################################
+
+async def async_download_object(client, semaphore, bucket_name, object_name, file_name, chunk_size=1024 * 1024):
+    """Download an object from a bucket to a local file
+
+    :param client: Async S3 client from create_async_s3_client
+    :param semaphore: asyncio.Semaphore bounding the requests in flight
+    :param bucket_name: string
+    :param object_name: string
+    :param file_name: Local path to write to
+    :param chunk_size: Bytes read from the response body at a time
+    :return: True if the object was downloaded, else False
+    """
+
+    try:
+        async with semaphore:
+            response = await client.get_object(Bucket=bucket_name, Key=object_name)
+            # Read from the StreamingBody itself: the object bound by 'async with' is the
+            # underlying aiohttp response, whose read() takes no size
+            body = response['Body']
+            with open(file_name, 'wb') as f:
+                async with body:
+                    while chunk := await body.read(chunk_size):
+                        await asyncio.to_thread(f.write, chunk)
+        logging.info(f"Downloaded {object_name} to {file_name}")
+        return True
+    except (BotoCoreError, ClientError, OSError) as e:
+        logging.error(e)
+        return False
+
+
+#########################################################
+# Deletion
+#########################################################
+
+async def async_delete_objects_from_bucket(client, semaphore, bucket_name, object_list, batch_size=1000):
+    """Delete objects from a bucket, sending the 1000-key batches concurrently
+
+    :param client: Async S3 client from create_async_s3_client
+    :param semaphore: asyncio.Semaphore bounding the requests in flight
+    :param bucket_name: string
+    :param object_list: list of strings
+    :param batch_size: Keys per DeleteObjects request (at most 1000)
+    :return: True if all objects were deleted, else False
+    """
+
+    async def delete_batch(batch):
+        try:
+            async with semaphore:
+                response = await client.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        except (BotoCoreError, ClientError) as e:
+            logging.error(e)
+            return False
+        for error in response.get('Errors', []):
+            logging.error(f"Couldn't delete {error['Key']}: {error['Code']} {error['Message']}")
+        return not response.get('Errors')
+
+    batches = [object_list[i:i + batch_size] for i in range(0, len(object_list), batch_size)]
+    results = await asyncio.gather(*(delete_batch(batch) for batch in batches))
+    return all(results)
+
+
+#########################################################
+# Synchronous Wrappers
+#########################################################
+
+async def _with_client(operation, max_concurrency, client_kwargs):
+    async with create_async_s3_client(max_pool_connections=max_concurrency, **client_kwargs) as client:
+        return await operation(client, asyncio.Semaphore(max_concurrency))
+
+
+def list_objects(bucket_name, prefix=None, **client_kwargs):
+    """Retrieve the list of objects in a bucket, running the async lister to completion
+
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param client_kwargs: Extra arguments for create_async_s3_client
+    :return: List of objects in the bucket
+    """
+
+    async def operation(client, semaphore):
+        return await async_get_list_objects_in_bucket(client, bucket_name, prefix=prefix)
+    return asyncio.run(_with_client(operation, 1, client_kwargs))
+
+
+def upload_files(file_names, bucket, object_names=None, max_concurrency=64, **client_kwargs):
+    """Upload many files to an S3 bucket on one event loop
+
+    :param file_names: list of files to upload
+    :param bucket: Bucket to upload to
+    :param object_names: list of S3 object names. If not specified, the file names are used
+    :param max_concurrency: Maximum number of requests in flight
+    :param client_kwargs: Extra arguments for create_async_s3_client
+    :return: List of booleans, True for each file that was uploaded
+    """
+
+    object_names = object_names or [None] * len(file_names)
+
+    async def operation(client, semaphore):
+        return await asyncio.gather(*(async_upload_file(client, semaphore, file_name, bucket, object_name)
+                                      for file_name, object_name in zip(file_names, object_names)))
+    return asyncio.run(_with_client(operation, max_concurrency, client_kwargs))
+
+
+def download_objects(bucket_name, object_list, directory_destiny, max_concurrency=64, **client_kwargs):
+    """Download many objects from a bucket on one event loop
+
+    :param bucket_name: string
+    :param object_list: list of strings
+    :param directory_destiny: string
+    :param max_concurrency: Maximum number of requests in flight
+    :param client_kwargs: Extra arguments for create_async_s3_client
+    :return: True if all objects were downloaded, else False
+    """
+
+    os.makedirs(directory_destiny, exist_ok=True)
+
+    async def operation(client, semaphore):
+        return await asyncio.gather(*(
+            async_download_object(client, semaphore, bucket_name, object_name,
+                                  os.path.join(directory_destiny, os.path.basename(object_name)))
+            for object_name in object_list))
+    return all(asyncio.run(_with_client(operation, max_concurrency, client_kwargs)))
+
+
+def delete_objects(bucket_name, object_list, max_concurrency=16, **client_kwargs):
+    """Delete many objects from a bucket on one event loop
+
+    :param bucket_name: string
+    :param object_list: list of strings
+    :param max_concurrency: Maximum number of DeleteObjects requests in flight
+    :param client_kwargs: Extra arguments for create_async_s3_client
+    :return: True if all objects were deleted, else False
+    """
+
+    async def operation(client, semaphore):
+        return await async_delete_objects_from_bucket(client, semaphore, bucket_name, list(object_list))
+    return asyncio.run(_with_client(operation, max_concurrency, client_kwargs))
@@ -7,15 +7,30 @@ the CORS and policies from a bucket.
 """
 
 #%%
+import errno
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import logging
+import mimetypes
+import queue
+import random
 import sys
+import tempfile
+import threading
 import time
-import boto3
-from botocore.exceptions import ClientError
-from dotenv import load_dotenv
-import yfinance as yf
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from botocore.exceptions import BotoCoreError, ClientError
 import os
 import json
+from concurrency_controller import register_adaptive_concurrency
+from cost_ledger import CallSiteExecutor, get_cost_ledger, track_client, write_ledger
+from file_utils import write_atomically
+from instrumentation import instrument_client, write_metrics
+from object_cache import get_object_cache
 
 
 #########################################################
@@ -45,6 +60,8 @@ def create_bucket(client, bucket_name, region=None):
     except ClientError as e:
         logging.error(e)
         return False
+    finally:
+        invalidate_bucket_cache(bucket_name)
 
 #########################################################
 #  Listing
@@ -64,48 +81,537 @@ def get_list_of_existing_buckets(client):
         return []
 
 
-def check_if_bucket_exists(client, bucket_name):
-    """Check if a bucket exists
-    
+BUCKET_EXISTS_TTL = 300.0
+_bucket_probe_cache = {}
+_bucket_probe_lock = threading.Lock()
+
+
+def probe_bucket(client, bucket_name, ttl=None):
+    """Probe a bucket with a HeadBucket request, caching the result for this process
+
+    Unlike listing every bucket of the account, HeadBucket costs a single request
+    regardless of the number of buckets, and its status code tells a bucket that
+    does not exist (404) apart from one that exists but belongs to someone else or
+    is not accessible with the current credentials (403). A successful HeadBucket only
+    proves the bucket is accessible, not that it belongs to this account: a readable bucket
+    of another account is reported as 'accessible' too.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to probe
+    :param ttl: Seconds a cached result stays valid. If not specified, BUCKET_EXISTS_TTL is used
+    :return: 'accessible' if the bucket is accessible, 'forbidden' if it exists but is not
+    accessible, 'missing' if it does not exist, or None if the probe failed
+    """
+
+    ttl = BUCKET_EXISTS_TTL if ttl is None else ttl
+    now = time.monotonic()
+    with _bucket_probe_lock:
+        cached = _bucket_probe_cache.get(bucket_name)
+    if cached is not None and now - cached[1] < ttl:
+        return cached[0]
+
+    try:
+        client.head_bucket(Bucket=bucket_name)
+        status = 'accessible'
+    except ClientError as e:
+        code = str(e.response.get('Error', {}).get('Code'))
+        http_status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        if code in ('404', 'NoSuchBucket') or http_status == 404:
+            status = 'missing'
+        elif code in ('403', 'AccessDenied') or http_status == 403:
+            status = 'forbidden'
+        else:
+            logging.error(e)
+            return None
+
+    with _bucket_probe_lock:
+        _bucket_probe_cache[bucket_name] = (status, now)
+    return status
+
+
+def invalidate_bucket_cache(bucket_name=None):
+    """Drop cached bucket probes
+
+    :param bucket_name: Bucket to forget. If not specified, the whole cache is cleared
+    """
+
+    with _bucket_probe_lock:
+        if bucket_name is None:
+            _bucket_probe_cache.clear()
+        else:
+            _bucket_probe_cache.pop(bucket_name, None)
+
+
+def check_if_bucket_exists(client, bucket_name, ttl=None):
+    """Check if a bucket exists and is accessible
+
+    Unlike a lookup in get_list_of_existing_buckets, this is also True for a bucket of
+    another account that the current credentials can access.
+
     :param client: S3 Client used to connect with AWS
     :param bucket_name: Bucket to check
-    :return: True if bucket exists, else False
+    :param ttl: Seconds a cached result stays valid. If not specified, BUCKET_EXISTS_TTL is used
+    :return: True if bucket exists and is accessible, else False
     """
 
-    buckets = get_list_of_existing_buckets(client)
-    return True if bucket_name in buckets else False
+    status = probe_bucket(client, bucket_name, ttl=ttl)
+    if status == 'forbidden':
+        logging.warning(f"Bucket '{bucket_name}' exists but is not accessible.")
+    return status == 'accessible'
+
 
+def iter_list_objects_pages(client, bucket_name, prefix=None, delimiter=None, start_after=None,
+                            page_size=1000, prefetch=True):
+    """Iterate over the raw pages of a list_objects_v2 listing, following continuation tokens
 
-def get_list_objects_in_bucket(client, bucket_name):
+    While the caller is consuming a page, the request for the next page is already in flight
+    on a background thread (when prefetch is True), so at most two pages are held in memory.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param delimiter: Character used to group keys into CommonPrefixes, e.g., '/'
+    :param start_after: Only list keys that sort after this key
+    :param page_size: Maximum number of keys per page (S3 caps it at 1000)
+    :param prefetch: If True, fetch the next page while the current one is being consumed
+    :return: Generator of list_objects_v2 response dicts
+    """
+
+    kwargs = {'Bucket': bucket_name, 'MaxKeys': page_size}
+    if prefix:
+        kwargs['Prefix'] = prefix
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    if start_after:
+        kwargs['StartAfter'] = start_after
+
+    def fetch(token):
+        if token is None:
+            return client.list_objects_v2(**kwargs)
+        return client.list_objects_v2(**kwargs, ContinuationToken=token)
+
+    if not prefetch:
+        token = None
+        while True:
+            response = fetch(token)
+            yield response
+            if not response.get('IsTruncated'):
+                return
+            token = response['NextContinuationToken']
+
+    with CallSiteExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch, None)
+        while future is not None:
+            response = future.result()
+            if response.get('IsTruncated'):
+                future = executor.submit(fetch, response['NextContinuationToken'])
+            else:
+                future = None
+            yield response
+
+
+def iter_objects_in_bucket(client, bucket_name, prefix=None, delimiter=None, start_after=None,
+                           page_size=1000, prefetch=True):
+    """Lazily iterate over the objects in a bucket
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param delimiter: Character used to group keys; grouped keys are not yielded
+    :param start_after: Only list keys that sort after this key
+    :param page_size: Maximum number of keys per request
+    :param prefetch: If True, fetch the next page while the current one is being consumed
+    :return: Generator of object dicts (Key, Size, ETag, LastModified, ...)
+    """
+
+    pages = iter_list_objects_pages(client, bucket_name, prefix=prefix, delimiter=delimiter,
+                                    start_after=start_after, page_size=page_size, prefetch=prefetch)
+    for page in pages:
+        yield from page.get('Contents', [])
+
+
+def iter_keys_in_bucket(client, bucket_name, prefix=None, delimiter=None, start_after=None,
+                        page_size=1000, prefetch=True):
+    """Lazily iterate over the keys of the objects in a bucket
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param delimiter: Character used to group keys; grouped keys are not yielded
+    :param start_after: Only list keys that sort after this key
+    :param page_size: Maximum number of keys per request
+    :param prefetch: If True, fetch the next page while the current one is being consumed
+    :return: Generator of object keys
+    """
+
+    objects = iter_objects_in_bucket(client, bucket_name, prefix=prefix, delimiter=delimiter,
+                                     start_after=start_after, page_size=page_size, prefetch=prefetch)
+    for content in objects:
+        yield content['Key']
+
+
+def get_list_objects_in_bucket(client, bucket_name, prefix=None, delimiter=None, start_after=None,
+                               page_size=1000):
     """Retrieve the list of objects in a bucket
-    
+
+    Unlike a single list_objects_v2 call, the listing is not truncated at 1000 keys.
+    Prefer iter_keys_in_bucket when the bucket is large and the keys can be consumed lazily.
+
     :param client: S3 Client used to connect with AWS
     :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param delimiter: Character used to group keys; grouped keys are not listed
+    :param start_after: Only list keys that sort after this key
+    :param page_size: Maximum number of keys per request
     :return: List of objects in the bucket
     """
 
-    response = client.list_objects_v2(Bucket=bucket_name)
-    file_count = response['KeyCount']
-    if file_count > 0:
-        list_of_objects = [content['Key'] for content in response["Contents"]]
-        return list_of_objects
-    else:
+    list_of_objects = list(iter_keys_in_bucket(client, bucket_name, prefix=prefix, delimiter=delimiter,
+                                               start_after=start_after, page_size=page_size))
+    if not list_of_objects:
         logging.info(f"Bucket '{bucket_name}' is empty.")
-        return []
+    return list_of_objects
     
     
 
+#########################################################
+#  Sharded Listing
+#########################################################
+
+_SHARD_DONE = object()
+
+
+def discover_prefix_shards(client, bucket_name, prefix=None, delimiter='/', depth=1, max_workers=8):
+    """Discover the common prefixes of a bucket to be used as independent listing shards
+
+    With depth=2 and a layout like 'ticker=AAPL/year=2022/...', the shards are the
+    'ticker=*/year=*/' prefixes. Levels that also hold objects directly (outside any deeper
+    prefix) are returned separately, so those objects can be listed lazily with the
+    delimiter; nothing is buffered. A level whose first page holds objects only and is
+    truncated (e.g., a flat bucket) is not descended into and becomes a shard itself, so
+    discovery never lists a flat bucket end to end.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to discover the shards of
+    :param prefix: Prefix to start the discovery from
+    :param delimiter: Character used to group keys into prefixes
+    :param depth: Number of delimiter levels to descend
+    :param max_workers: Number of prefixes listed concurrently on each level
+    :return: Tuple (sorted list of shard prefixes, sorted list of the prefixes of the levels
+    holding objects outside the shards)
+    """
+
+    def list_level(level):
+        prefixes, has_objects = [], False
+        pages = iter_list_objects_pages(client, bucket_name, prefix=level, delimiter=delimiter, prefetch=False)
+        for page in pages:
+            page_prefixes = [common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', [])]
+            if not prefixes and not page_prefixes and page.get('IsTruncated'):
+                pages.close()
+                return None, False
+            prefixes.extend(page_prefixes)
+            has_objects = has_objects or bool(page.get('Contents'))
+        return prefixes, has_objects
+
+    shards, loose_levels = [], []
+    levels = [prefix or '']
+    with CallSiteExecutor(max_workers=max_workers) as executor:
+        for _ in range(depth):
+            next_levels = []
+            for level, (prefixes, has_objects) in zip(levels, executor.map(list_level, levels)):
+                if prefixes is None:
+                    shards.append(level)
+                    continue
+                if has_objects:
+                    loose_levels.append(level)
+                next_levels.extend(prefixes)
+            levels = next_levels
+            if not levels:
+                break
+    return sorted(shards + levels), sorted(loose_levels)
+
+
+def _put_until_stopped(out, item, stop):
+    """Put an item in a bounded queue, giving up if the consumer has stopped"""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain_shard_queue(out, shard_count):
+    """Yield the items of a shard queue until every shard feeding it is done"""
+    remaining = shard_count
+    while remaining:
+        item = out.get()
+        if item is _SHARD_DONE:
+            remaining -= 1
+        elif isinstance(item, BaseException):
+            raise item
+        else:
+            yield item
+
+
+def iter_objects_sharded(client, bucket_name, prefix=None, delimiter='/', depth=1, max_workers=8,
+                         ordered=False, queue_size=1000, shard_stats=None):
+    """Lazily iterate over the objects in a bucket, listing each prefix shard concurrently
+
+    The shards are discovered with discover_prefix_shards and each one is listed with
+    iter_objects_in_bucket on a bounded thread pool, as are the objects lying directly in
+    the discovered levels. When ordered is False, objects are
+    yielded as soon as any shard produces them; when it is True, they are yielded in
+    lexicographic key order, the same order a serial listing would produce.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param delimiter: Character used to group keys into shards
+    :param depth: Number of delimiter levels used to build the shards
+    :param max_workers: Maximum number of shards listed at the same time
+    :param ordered: If True, yield objects in key order
+    :param queue_size: Maximum number of listed objects buffered per queue
+    :param shard_stats: Optional dict filled with {shard: {'keys', 'seconds', 'keys_per_second'}}
+    :return: Generator of object dicts (Key, Size, ETag, LastModified, ...)
+    """
+
+    shards, loose_levels = discover_prefix_shards(client, bucket_name, prefix=prefix, delimiter=delimiter,
+                                                   depth=depth, max_workers=max_workers)
+    if shard_stats is None:
+        shard_stats = {}
+    stop = threading.Event()
+
+    def list_shard(shard, out, shard_delimiter=None):
+        if stop.is_set():
+            return
+        start = time.perf_counter()
+        count = 0
+        try:
+            for content in iter_objects_in_bucket(client, bucket_name, prefix=shard, delimiter=shard_delimiter,
+                                                  prefetch=False):
+                if not _put_until_stopped(out, content, stop):
+                    return
+                count += 1
+        except Exception as e:
+            _put_until_stopped(out, e, stop)
+            return
+        finally:
+            elapsed = time.perf_counter() - start
+            rate = count / elapsed if elapsed > 0 else 0.0
+            shard_stats[shard] = {'keys': count, 'seconds': elapsed, 'keys_per_second': rate}
+            logging.info(f"Listed {count} keys from shard '{shard}' in {elapsed:.2f}s ({rate:.0f} keys/s)")
+        _put_until_stopped(out, _SHARD_DONE, stop)
+
+    executor = CallSiteExecutor(max_workers=max_workers)
+    try:
+        if ordered:
+            shard_queues = {}
+            for shard in shards:
+                shard_queues[shard] = queue.Queue(maxsize=queue_size)
+                executor.submit(list_shard, shard, shard_queues[shard])
+            # Shards never nest, so draining them in prefix order yields their keys in order;
+            # the objects lying directly in a level interleave with them and are merged in,
+            # listed on this thread so that no worker waits on the merge
+            in_shards = (content for shard in shards for content in _drain_shard_queue(shard_queues.pop(shard), 1))
+            loose = [iter_objects_in_bucket(client, bucket_name, prefix=level, delimiter=delimiter)
+                     for level in loose_levels]
+            yield from heapq.merge(in_shards, *loose, key=lambda content: content['Key'])
+        else:
+            out = queue.Queue(maxsize=queue_size)
+            for shard in shards:
+                executor.submit(list_shard, shard, out)
+            for level in loose_levels:
+                executor.submit(list_shard, level, out, delimiter)
+            yield from _drain_shard_queue(out, len(shards) + len(loose_levels))
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_keys_sharded(client, bucket_name, prefix=None, delimiter='/', depth=1, max_workers=8,
+                      ordered=False, shard_stats=None):
+    """Lazily iterate over the keys in a bucket, listing each prefix shard concurrently
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to retrieve objects from
+    :param prefix: Only list keys beginning with this prefix
+    :param delimiter: Character used to group keys into shards
+    :param depth: Number of delimiter levels used to build the shards
+    :param max_workers: Maximum number of shards listed at the same time
+    :param ordered: If True, yield keys in lexicographic order
+    :param shard_stats: Optional dict filled with the listing rate of each shard
+    :return: Generator of object keys
+    """
+
+    objects = iter_objects_sharded(client, bucket_name, prefix=prefix, delimiter=delimiter, depth=depth,
+                                   max_workers=max_workers, ordered=ordered, shard_stats=shard_stats)
+    for content in objects:
+        yield content['Key']
+
+
+#########################################################
+# Transfer Configuration
+#########################################################
+
+MiB = 1024 * 1024
+GiB = 1024 * MiB
+
+# S3 multipart limits: parts between 5 MiB and 5 GiB, at most 10,000 parts per object
+MIN_PART_SIZE = 5 * MiB
+MAX_PART_SIZE = 5 * GiB
+MAX_PARTS = 10000
+
+DEFAULT_CONNECTION_THROUGHPUT = 64 * MiB
+
+TRANSFER_PROFILES = {
+    # Many objects of a few KB/MB each: parallelism comes from transferring several
+    # files at once, so each file is sent in one request with little per-file overhead
+    'many-small': {
+        'multipart_threshold': 64 * MiB,
+        'multipart_chunksize': 16 * MiB,
+        'max_concurrency': 2,
+        'io_chunksize': 64 * 1024,
+    },
+    # A few objects of several GB: large parts keep the part count low and many
+    # concurrent parts work around the per-connection throughput cap
+    'few-huge': {
+        'multipart_threshold': 16 * MiB,
+        'multipart_chunksize': 128 * MiB,
+        'max_concurrency': 32,
+        'io_chunksize': 1 * MiB,
+    },
+}
+
+_measured_throughput = None
+
+
+def measure_connection_throughput(client, bucket, key, sample_bytes=16 * MiB):
+    """Measure the throughput of a single connection with a ranged GET
+
+    The measurement is kept for this process and used by get_transfer_config when no
+    throughput is given explicitly.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: Bucket holding the sample object
+    :param key: Object to sample, ideally at least sample_bytes long
+    :param sample_bytes: Number of bytes to download
+    :return: Measured throughput in bytes per second, or None if the measurement failed
+    """
+
+    global _measured_throughput
+    try:
+        start = time.perf_counter()
+        response = client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{sample_bytes - 1}")
+        received = 0
+        for chunk in iter(lambda: response['Body'].read(MiB), b''):
+            received += len(chunk)
+        elapsed = time.perf_counter() - start
+    except ClientError as e:
+        logging.error(e)
+        return None
+    if received == 0 or elapsed <= 0:
+        return None
+    _measured_throughput = received / elapsed
+    logging.info(f"Measured per-connection throughput of {_measured_throughput / MiB:.1f} MiB/s.")
+    return _measured_throughput
+
+
+def get_transfer_config(object_size=None, throughput=None, target_part_seconds=2.0, max_concurrency=32):
+    """Build a TransferConfig tuned to an object size and a per-connection throughput
+
+    Parts are sized so that each one takes about target_part_seconds on one connection,
+    within the S3 part size limits and never exceeding 10,000 parts. Concurrency grows
+    with the number of parts, and objects that fit in a single part skip multipart.
+
+    :param object_size: Size of the object in bytes. If not specified, only the throughput is used
+    :param throughput: Per-connection throughput in bytes per second. If not specified, the last
+    measurement from measure_connection_throughput (or DEFAULT_CONNECTION_THROUGHPUT) is used
+    :param target_part_seconds: Desired transfer time of a single part
+    :param max_concurrency: Upper bound of concurrent part transfers
+    :return: boto3 TransferConfig
+    """
+
+    from boto3.s3.transfer import TransferConfig
+
+    throughput = throughput or _measured_throughput or DEFAULT_CONNECTION_THROUGHPUT
+    chunk_size = int(throughput * target_part_seconds)
+    if object_size:
+        chunk_size = max(chunk_size, -(-object_size // MAX_PARTS))
+    chunk_size = min(max(chunk_size, 8 * MiB), MAX_PART_SIZE)
+    chunk_size = -(-chunk_size // MiB) * MiB
+
+    if object_size:
+        parts = max(1, -(-object_size // chunk_size))
+        concurrency = min(max_concurrency, parts)
+    else:
+        concurrency = max_concurrency // 2 or 1
+
+    return TransferConfig(
+        multipart_threshold=chunk_size,
+        multipart_chunksize=chunk_size,
+        max_concurrency=concurrency,
+        io_chunksize=1 * MiB if chunk_size >= 64 * MiB else 256 * 1024,
+    )
+
+
+def resolve_transfer_config(transfer_profile, object_size=None):
+    """Turn a transfer profile selection into a TransferConfig
+
+    :param transfer_profile: None for the boto3 defaults, a TransferConfig, 'auto' to tune it
+    with get_transfer_config, or the name of one of TRANSFER_PROFILES
+    :param object_size: Size of the object in bytes, used by 'auto'
+    :return: boto3 TransferConfig, or None for the boto3 defaults
+    """
+
+    if transfer_profile is None:
+        return None
+    from boto3.s3.transfer import TransferConfig
+
+    if isinstance(transfer_profile, TransferConfig):
+        return transfer_profile
+    if transfer_profile == 'auto':
+        return get_transfer_config(object_size=object_size)
+    if transfer_profile in TRANSFER_PROFILES:
+        return TransferConfig(**TRANSFER_PROFILES[transfer_profile])
+    raise ValueError(f"Unknown transfer profile '{transfer_profile}'. "
+                     f"Use 'auto' or one of {sorted(TRANSFER_PROFILES)}.")
+
+def _resolve_object_transfer_config(client, bucket, object_name, transfer_profile, object_size=None):
+    """Resolve a transfer profile for one object, sizing 'auto' from object_size or, if unknown, a HeadObject"""
+    if transfer_profile != 'auto':
+        return resolve_transfer_config(transfer_profile)
+    if object_size is None:
+        try:
+            object_size = client.head_object(Bucket=bucket, Key=object_name)['ContentLength']
+        except (ClientError, BotoCoreError) as e:
+            logging.warning(f"Couldn't size {object_name} for the 'auto' transfer profile: {e}")
+    return get_transfer_config(object_size=object_size)
+
+
+def _split_object_item(item):
+    """Return (key, size or None) of a key string or of a listing dict with 'Key' and 'Size'"""
+    if isinstance(item, dict):
+        return item['Key'], item.get('Size')
+    return item, None
+
 #########################################################
 # Upload
 #########################################################
 
-def upload_file(client, file_name, bucket, object_name=None):
+def upload_file(client, file_name, bucket, object_name=None, transfer_profile=None, compression=None,
+                resumable=False):
     """Upload a file to an S3 bucket
 
     :param client: S3 Client used to connect with AWS
     :param file_name: File to upload
     :param bucket: Bucket to upload to
     :param object_name: S3 object name. If not specified then file_name is used
+    :param transfer_profile: None, a TransferConfig, 'auto' or a name from TRANSFER_PROFILES
+    :param compression: None, 'gzip' or 'zstd'. If given, the file is compressed in parallel
+    while uploading with upload_file_compressed, and the codec suffix is appended to the key
+    :param resumable: If True, upload with upload_file_resumable, which can resume after a crash
     :return: True if file was uploaded, else False
     """
 
@@ -113,93 +619,1444 @@ def upload_file(client, file_name, bucket, object_name=None):
     if object_name is None:
         object_name = os.path.basename(file_name)
 
+    if compression is not None:
+        return upload_file_compressed(client, file_name, bucket, object_name, codec=compression) is not None
+    if resumable:
+        config = resolve_transfer_config(transfer_profile, object_size=os.path.getsize(file_name))
+        part_size = config.multipart_chunksize if config is not None else None
+        return upload_file_resumable(client, file_name, bucket, object_name, part_size=part_size)
+
     # Upload the file
     try:
-        response = client.upload_file(file_name, bucket, object_name)
+        size = os.path.getsize(file_name) if transfer_profile == 'auto' else None
+        config = resolve_transfer_config(transfer_profile, object_size=size)
+        response = client.upload_file(file_name, bucket, object_name, Config=config)
+        return True
+    except ClientError as e:
+        logging.error(e)
+        return False
+
+SINGLE_PUT_THRESHOLD = 8 * 1024 * 1024
+
+
+def upload_file_with_result(client, file_name, bucket, object_name=None, transfer_profile=None):
+    """Upload a file to an S3 bucket and describe the outcome
+
+    Files smaller than SINGLE_PUT_THRESHOLD are sent with a single PutObject, whose
+    response already carries the ETag. Larger files go through the managed multipart
+    transfer and their ETag is fetched with a HeadObject afterwards.
+
+    :param client: S3 Client used to connect with AWS
+    :param file_name: File to upload
+    :param bucket: Bucket to upload to
+    :param object_name: S3 object name. If not specified then file_name is used
+    :param transfer_profile: None, a TransferConfig, 'auto' or a name from TRANSFER_PROFILES
+    :return: dict with 'file', 'key', 'bytes', 'seconds', 'etag' and 'error' (None on success)
+    """
+
+    from boto3.exceptions import S3UploadFailedError
+
+    if object_name is None:
+        object_name = os.path.basename(file_name)
+
+    result = {'file': file_name, 'key': object_name, 'bytes': 0, 'seconds': 0.0, 'etag': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        result['bytes'] = os.path.getsize(file_name)
+        if result['bytes'] < SINGLE_PUT_THRESHOLD:
+            with open(file_name, 'rb') as body:
+                response = client.put_object(Bucket=bucket, Key=object_name, Body=body)
+        else:
+            config = resolve_transfer_config(transfer_profile, object_size=result['bytes'])
+            client.upload_file(file_name, bucket, object_name, Config=config)
+            response = client.head_object(Bucket=bucket, Key=object_name)
+        result['etag'] = response['ETag']
+    except (ClientError, BotoCoreError, S3UploadFailedError, OSError) as e:
+        logging.error(e)
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def upload_directory(client, directory, bucket, prefix='', max_workers=16, recursive=True,
+                     transfer_profile='many-small'):
+    """Upload every file of a directory tree to an S3 bucket concurrently
+
+    The path of each file relative to the directory is kept as its key, below the given
+    prefix, using '/' as separator. Failed files are reported in their result instead
+    of interrupting the other uploads.
+
+    :param client: S3 Client used to connect with AWS
+    :param directory: Local directory to upload
+    :param bucket: Bucket to upload to
+    :param prefix: Prefix prepended to every key, e.g., 'raw/'
+    :param max_workers: Maximum number of files uploaded at the same time
+    :param recursive: If True, upload the files of subdirectories as well
+    :param transfer_profile: Transfer profile used by the files above SINGLE_PUT_THRESHOLD
+    :return: Tuple (list of per-file results from upload_file_with_result, dict of aggregate stats)
+    """
+
+    root = os.path.abspath(directory)
+    if recursive:
+        file_names = [os.path.join(path, name) for path, _, names in os.walk(root) for name in names]
+    else:
+        file_names = [entry.path for entry in os.scandir(root) if entry.is_file()]
+    keys = [prefix + os.path.relpath(file_name, root).replace(os.sep, '/') for file_name in file_names]
+
+    start = time.perf_counter()
+    with CallSiteExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            lambda file_and_key: upload_file_with_result(client, file_and_key[0], bucket, file_and_key[1],
+                                                         transfer_profile=transfer_profile),
+            zip(file_names, keys)))
+    elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result['error'] is None]
+    total_bytes = sum(result['bytes'] for result in succeeded)
+    stats = {
+        'files': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'bytes': total_bytes,
+        'seconds': elapsed,
+        'files_per_second': len(succeeded) / elapsed if elapsed > 0 else 0.0,
+        'bytes_per_second': total_bytes / elapsed if elapsed > 0 else 0.0,
+    }
+    logging.info(f"Uploaded {stats['succeeded']}/{stats['files']} files ({total_bytes} bytes) "
+                 f"to '{bucket}' in {elapsed:.2f}s.")
+    return results, stats
+
+DATAFRAME_CONTENT_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+# Codecs each format can be written with; Parquet compresses its pages with the codecs pyarrow supports
+DATAFRAME_COMPRESSIONS = {
+    'csv': tuple(COMPRESSION_SUFFIXES),
+    'parquet': (None, 'snappy', 'gzip', 'brotli', 'lz4', 'zstd'),
+}
+
+
+def validate_dataframe_format(file_format, compression=None):
+    """Raise a ValueError unless a DataFrame can be serialized with the format and codec
+
+    :param file_format: 'csv' or 'parquet'
+    :param compression: A codec of DATAFRAME_COMPRESSIONS for the format
+    """
+
+    if file_format not in DATAFRAME_CONTENT_TYPES:
+        raise ValueError(f"Unsupported file format '{file_format}'. Use one of {sorted(DATAFRAME_CONTENT_TYPES)}.")
+    if compression not in DATAFRAME_COMPRESSIONS[file_format]:
+        raise ValueError(f"Unsupported compression '{compression}' for {file_format}. "
+                         f"Use one of {list(DATAFRAME_COMPRESSIONS[file_format])}.")
+
+
+def get_dataframe_object_name(object_name, file_format='csv', compression=None):
+    """Append the format and compression suffix to an object name, if it is missing
+
+    Parquet compresses its pages internally, so its objects only get the '.parquet' suffix.
+
+    :param object_name: string, e.g., 'AAPL' or 'raw/AAPL.csv'
+    :param file_format: 'csv' or 'parquet'
+    :param compression: None, 'gzip', 'bz2', 'xz' or 'zstd'
+    :return: Object name ending with the proper suffix, e.g., 'AAPL.csv.gz'
+    """
+
+    suffix = f".{file_format}"
+    if file_format == 'csv':
+        suffix += COMPRESSION_SUFFIXES[compression]
+    return object_name if object_name.endswith(suffix) else object_name + suffix
+
+
+def upload_dataframe(client, df, bucket, object_name, file_format='csv', compression=None,
+                     spool_max_size=64 * MiB, transfer_profile='auto', **writer_kwargs):
+    """Serialize a DataFrame in memory and upload it to an S3 bucket, without a local file
+
+    The DataFrame is written to a spooled buffer, which stays in memory up to
+    spool_max_size bytes and only then spills to a temporary file, and the buffer is
+    streamed with upload_fileobj (in multipart parts above the transfer threshold).
+
+    :param client: S3 Client used to connect with AWS
+    :param df: pandas DataFrame to upload
+    :param bucket: Bucket to upload to
+    :param object_name: S3 object name; the format and compression suffix is appended if missing
+    :param file_format: 'csv' or 'parquet'
+    :param compression: A codec of DATAFRAME_COMPRESSIONS for the format: None, 'gzip', 'bz2', 'xz' or
+    'zstd' for CSV (zstd needs the zstandard package), None (snappy), 'snappy', 'gzip', 'brotli', 'lz4' or
+    'zstd' for Parquet
+    :param spool_max_size: Bytes kept in memory before the buffer spills to disk
+    :param transfer_profile: None, a TransferConfig, 'auto' or a name from TRANSFER_PROFILES
+    :param writer_kwargs: Extra arguments for DataFrame.to_csv or DataFrame.to_parquet
+    :return: Key of the uploaded object, or None if the upload failed
+    """
+
+    from boto3.exceptions import S3UploadFailedError
+
+    validate_dataframe_format(file_format, compression)
+    object_name = get_dataframe_object_name(object_name, file_format, compression)
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=spool_max_size) as buffer:
+            if file_format == 'csv':
+                df.to_csv(buffer, compression=compression, **writer_kwargs)
+            else:
+                df.to_parquet(buffer, compression=compression or 'snappy', **writer_kwargs)
+            size = buffer.tell()
+            buffer.seek(0)
+            config = resolve_transfer_config(transfer_profile, object_size=size)
+            client.upload_fileobj(buffer, bucket, object_name,
+                                  ExtraArgs={'ContentType': DATAFRAME_CONTENT_TYPES[file_format]}, Config=config)
+        return object_name
+    except (ClientError, S3UploadFailedError) as e:
+        logging.error(e)
+        return None
+
+#########################################################
+# Compression
+#########################################################
+
+COMPRESSION_CONTENT_TYPES = {'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+
+
+def _get_chunk_compressor(codec, level):
+    """Return a function compressing one chunk into an independent gzip member or zstd frame"""
+    if codec == 'gzip':
+        return lambda chunk: gzip.compress(chunk, compresslevel=level, mtime=0)
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("zstd compression requires the 'zstandard' package") from e
+        local = threading.local()
+
+        def compress(chunk):
+            # ZstdCompressor instances are not thread-safe, so each worker keeps its own
+            if not hasattr(local, 'compressor'):
+                local.compressor = zstandard.ZstdCompressor(level=level)
+            return local.compressor.compress(chunk)
+        return compress
+    raise ValueError(f"Unsupported codec '{codec}'. Use one of {sorted(COMPRESSION_CONTENT_TYPES)}.")
+
+
+def iter_compressed_chunks(file_obj, codec='gzip', level=6, chunk_size=16 * MiB, max_workers=None):
+    """Compress a stream in parallel, chunk by chunk, yielding the compressed chunks in order
+
+    Each chunk becomes an independent gzip member or zstd frame; concatenated, they form a
+    valid gzip or zstd stream. zlib and zstd release the GIL, so the chunks are compressed
+    on a thread pool, with at most two chunks per worker held in memory.
+
+    :param file_obj: Binary file-like object to read from
+    :param codec: 'gzip' or 'zstd'
+    :param level: Compression level
+    :param chunk_size: Uncompressed bytes per chunk
+    :param max_workers: Number of compression threads. If not specified, the number of CPUs is used
+    :return: Generator of compressed byte strings
+    """
+
+    compress = _get_chunk_compressor(codec, level)
+    max_workers = max_workers or os.cpu_count() or 1
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+            pending.append(executor.submit(compress, chunk))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def upload_file_compressed(client, file_name, bucket, object_name=None, codec='gzip', level=6,
+                           chunk_size=16 * MiB, part_size=16 * MiB, max_workers=None, content_encoding=False):
+    """Compress a file in parallel while streaming it to an S3 bucket
+
+    The compressed chunks are gathered into multipart parts of at least part_size bytes
+    and each part is sent as soon as it is complete, so neither the compressed file nor
+    the whole original file is ever held in memory or written to disk. Output that fits
+    in a single part is sent with one PutObject instead.
+
+    By default the object gets a '.gz' or '.zst' suffix and a compressed Content-Type, which
+    is what Athena and Glue expect. With content_encoding=True the original Content-Type is
+    kept and Content-Encoding is set instead, so HTTP clients decompress it transparently.
+
+    :param client: S3 Client used to connect with AWS
+    :param file_name: File to upload
+    :param bucket: Bucket to upload to
+    :param object_name: S3 object name. If not specified then file_name is used. The codec suffix
+    is appended if missing (not with content_encoding=True)
+    :param codec: 'gzip' or 'zstd'
+    :param level: Compression level
+    :param chunk_size: Uncompressed bytes per compressed chunk
+    :param part_size: Minimum compressed bytes per multipart part (S3 requires at least 5 MiB)
+    :param max_workers: Number of compression threads. If not specified, the number of CPUs is used
+    :param content_encoding: If True, set Content-Encoding instead of a compressed Content-Type
+    :return: Key of the uploaded object, or None if the upload failed
+    """
+
+    if object_name is None:
+        object_name = os.path.basename(file_name)
+    part_size = max(part_size, MIN_PART_SIZE)
+
+    if content_encoding:
+        extra_args = {'ContentType': mimetypes.guess_type(object_name)[0] or 'application/octet-stream',
+                      'ContentEncoding': codec}
+    else:
+        suffix = COMPRESSION_SUFFIXES[codec]
+        object_name = object_name if object_name.endswith(suffix) else object_name + suffix
+        extra_args = {'ContentType': COMPRESSION_CONTENT_TYPES[codec]}
+
+    upload_id = None
+    completed = False
+    parts = []
+    buffer = bytearray()
+    try:
+        with open(file_name, 'rb') as f:
+            for compressed in iter_compressed_chunks(f, codec, level, chunk_size, max_workers):
+                buffer += compressed
+                if len(buffer) < part_size:
+                    continue
+                if upload_id is None:
+                    upload_id = client.create_multipart_upload(Bucket=bucket, Key=object_name,
+                                                               **extra_args)['UploadId']
+                part_number = len(parts) + 1
+                response = client.upload_part(Bucket=bucket, Key=object_name, UploadId=upload_id,
+                                              PartNumber=part_number, Body=bytes(buffer))
+                parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+                buffer.clear()
+
+        if upload_id is None:
+            client.put_object(Bucket=bucket, Key=object_name, Body=bytes(buffer), **extra_args)
+            return object_name
+        if buffer or not parts:
+            part_number = len(parts) + 1
+            response = client.upload_part(Bucket=bucket, Key=object_name, UploadId=upload_id,
+                                          PartNumber=part_number, Body=bytes(buffer))
+            parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        client.complete_multipart_upload(Bucket=bucket, Key=object_name, UploadId=upload_id,
+                                         MultipartUpload={'Parts': parts})
+        completed = True
+        return object_name
+    except (ClientError, BotoCoreError, OSError) as e:
+        logging.error(e)
+        return None
+    finally:
+        # Whatever interrupted the upload, its parts must not be left behind, billed
+        if upload_id is not None and not completed:
+            try:
+                client.abort_multipart_upload(Bucket=bucket, Key=object_name, UploadId=upload_id)
+            except (ClientError, BotoCoreError) as abort_error:
+                logging.error(abort_error)
+
+#########################################################
+# Packing
+#########################################################
+
+PACK_INDEX_NAME = "_index.json"
+
+
+class S3RangeReader(io.RawIOBase):
+    """Read-only, seekable file-like view of an S3 object that fetches bytes with ranged GETs
+
+    Lets readers such as pyarrow.parquet.ParquetFile fetch only the footer and the row
+    groups they need instead of the whole object.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: string
+    :param object_name: string
+    :param size: Size of the object. If not specified, it is fetched with a HeadObject
+    """
+
+    def __init__(self, client, bucket, object_name, size=None):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.object_name = object_name
+        self.size = size if size is not None else client.head_object(Bucket=bucket, Key=object_name)['ContentLength']
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        data = get_object_range(self.client, self.bucket, self.object_name, self.position, end - self.position)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def get_object_range(client, bucket, object_name, start, length):
+    """Download a byte range of an object
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: string
+    :param object_name: string
+    :param start: Offset of the first byte
+    :param length: Number of bytes
+    :return: bytes
+    """
+
+    response = client.get_object(Bucket=bucket, Key=object_name, Range=f"bytes={start}-{start + length - 1}")
+    return response['Body'].read()
+
+
+def pack_dataframes_to_bucket(client, frames, bucket, prefix='', target_size=128 * MiB, file_format='csv',
+                              spool_max_size=64 * MiB):
+    """Pack many small DataFrames into a few size-targeted objects, with a sidecar index
+
+    Each pack is a CSV with a single shared header, or a Parquet file with one row group
+    per DataFrame, and is uploaded as soon as it reaches target_size. The index, stored as
+    '<prefix>_index.json', maps each name to its pack and byte range (and row group), so a
+    single name can still be fetched with ranged GETs through get_packed_dataframe.
+    A 'Ticker' column holding the name is added to DataFrames that lack one.
+
+    :param client: S3 Client used to connect with AWS
+    :param frames: Iterable of (name, DataFrame) tuples, e.g., one per ticker
+    :param bucket: Bucket to upload to
+    :param prefix: Prefix of the pack objects and of the index, e.g., 'packed/'
+    :param target_size: Size in bytes at which a pack is closed and uploaded
+    :param file_format: 'csv' or 'parquet'
+    :param spool_max_size: Bytes of a pack kept in memory before it spills to disk
+    :return: The index dict, or None if an upload failed
+    """
+
+    from boto3.exceptions import S3UploadFailedError
+
+    if file_format not in DATAFRAME_CONTENT_TYPES:
+        raise ValueError(f"Unsupported file format '{file_format}'. Use one of {sorted(DATAFRAME_CONTENT_TYPES)}.")
+    if file_format == 'parquet':
+        import pyarrow
+        import pyarrow.parquet as pq
+
+    index = {'format': file_format, 'header': None, 'objects': [], 'entries': {}}
+    state = {'buffer': None, 'writer': None, 'entries': []}
+
+    def object_name():
+        return f"{prefix}part-{len(index['objects']):05d}.{file_format}"
+
+    def flush():
+        buffer = state['buffer']
+        if buffer is None:
+            return
+        if state['writer'] is not None:
+            state['writer'].close()
+            buffer.flush()
+            buffer.seek(0)
+            metadata = pq.read_metadata(buffer)
+            for row_group, entry in enumerate(state['entries']):
+                columns = [metadata.row_group(row_group).column(i) for i in range(metadata.num_columns)]
+                start = min(column.dictionary_page_offset or column.data_page_offset for column in columns)
+                end = max((column.dictionary_page_offset or column.data_page_offset) + column.total_compressed_size
+                          for column in columns)
+                entry.update(row_group=row_group, start=start, length=end - start)
+        size = buffer.seek(0, io.SEEK_END)
+        buffer.seek(0)
+        key = object_name()
+        client.upload_fileobj(buffer, bucket, key, ExtraArgs={'ContentType': DATAFRAME_CONTENT_TYPES[file_format]},
+                              Config=get_transfer_config(object_size=size))
+        buffer.close()
+        for entry in state['entries']:
+            name = entry.pop('name')
+            index['entries'][name] = dict(entry, key=key)
+        index['objects'].append(key)
+        logging.info(f"Uploaded pack '{key}' with {len(state['entries'])} entries ({size} bytes).")
+        state.update(buffer=None, writer=None, entries=[])
+
+    try:
+        for name, df in frames:
+            if 'Ticker' not in df.columns:
+                df = df.assign(Ticker=name)
+            if state['buffer'] is None:
+                state['buffer'] = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+            buffer = state['buffer']
+
+            if file_format == 'csv':
+                header = df.iloc[:0].to_csv()
+                if index['header'] is None:
+                    index['header'] = header
+                elif header != index['header']:
+                    raise ValueError(f"Columns of '{name}' do not match the pack header.")
+                if buffer.tell() == 0:
+                    buffer.write(header.encode())
+                start = buffer.tell()
+                buffer.write(df.to_csv(header=False).encode())
+                state['entries'].append({'name': name, 'start': start, 'length': buffer.tell() - start})
+            else:
+                table = pyarrow.Table.from_pandas(df)
+                if state['writer'] is None:
+                    state['writer'] = pq.ParquetWriter(buffer, table.schema)
+                state['writer'].write_table(table, row_group_size=max(len(table), 1))
+                state['entries'].append({'name': name})
+
+            if buffer.tell() >= target_size:
+                flush()
+        flush()
+
+        body = json.dumps(index).encode()
+        client.put_object(Bucket=bucket, Key=f"{prefix}{PACK_INDEX_NAME}", Body=body, ContentType='application/json')
+        return index
+    except (ClientError, S3UploadFailedError) as e:
+        logging.error(e)
+        return None
+    finally:
+        if state['buffer'] is not None:
+            state['buffer'].close()
+
+
+def get_pack_index(client, bucket, prefix=''):
+    """Retrieve the sidecar index written by pack_dataframes_to_bucket
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: string
+    :param prefix: Prefix the packs were written under
+    :return: The index dict, or None if it could not be retrieved
+    """
+
+    try:
+        response = client.get_object(Bucket=bucket, Key=f"{prefix}{PACK_INDEX_NAME}")
+        return json.loads(response['Body'].read())
+    except ClientError as e:
+        logging.error(e)
+        return None
+
+
+def get_packed_dataframe(client, bucket, index, name):
+    """Fetch a single packed DataFrame with ranged GETs, without downloading its whole pack
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: string
+    :param index: Index dict from pack_dataframes_to_bucket or get_pack_index
+    :param name: Name the DataFrame was packed under, e.g., a ticker
+    :return: pandas DataFrame
+    """
+
+    import pandas as pd
+
+    entry = index['entries'][name]
+    if index['format'] == 'csv':
+        body = index['header'].encode() + get_object_range(client, bucket, entry['key'], entry['start'], entry['length'])
+        return pd.read_csv(io.BytesIO(body), index_col=0)
+
+    import pyarrow.parquet as pq
+    with S3RangeReader(client, bucket, entry['key']) as reader:
+        return pq.ParquetFile(reader).read_row_group(entry['row_group']).to_pandas()
+
+#########################################################
+# Resumable Upload
+#########################################################
+
+def list_uploaded_parts(client, bucket, object_name, upload_id):
+    """Retrieve the parts already stored for a multipart upload
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: string
+    :param object_name: string
+    :param upload_id: string
+    :return: dict mapping part numbers to dicts with 'ETag' and 'Size'
+    """
+
+    parts = {}
+    kwargs = {'Bucket': bucket, 'Key': object_name, 'UploadId': upload_id}
+    while True:
+        response = client.list_parts(**kwargs)
+        for part in response.get('Parts', []):
+            parts[part['PartNumber']] = {'ETag': part['ETag'], 'Size': part['Size']}
+        if not response.get('IsTruncated'):
+            return parts
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+
+def upload_file_resumable(client, file_name, bucket, object_name=None, part_size=None, checkpoint_path=None,
+                          max_workers=8):
+    """Upload a file with a multipart upload that can resume after the process dies
+
+    The UploadId and the ETag of every completed part are recorded in a checkpoint file.
+    When called again for the same file, bucket and key, the parts confirmed by ListParts
+    are kept and only the missing ones are uploaded. The checkpoint is removed once the
+    upload completes; if the file changed since the checkpoint, the old upload is aborted
+    and a new one is started.
+
+    :param client: S3 Client used to connect with AWS
+    :param file_name: File to upload
+    :param bucket: Bucket to upload to
+    :param object_name: S3 object name. If not specified then file_name is used
+    :param part_size: Bytes per part. If not specified, get_transfer_config chooses it
+    :param checkpoint_path: Checkpoint file. If not specified, '<file_name>.s3upload.json' is used
+    :param max_workers: Maximum number of parts uploaded at the same time
+    :return: True if file was uploaded, else False
+    """
+
+    if object_name is None:
+        object_name = os.path.basename(file_name)
+    if checkpoint_path is None:
+        checkpoint_path = f"{file_name}.s3upload.json"
+
+    try:
+        file_stat = os.stat(file_name)
+        source = {'bucket': bucket, 'key': object_name, 'file_size': file_stat.st_size,
+                  'file_mtime': file_stat.st_mtime}
+
+        checkpoint = None
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if any(checkpoint.get(name) != value for name, value in source.items()):
+                logging.info(f"'{file_name}' changed since its checkpoint; restarting its upload.")
+                abort_multipart_upload(client, checkpoint['bucket'], checkpoint['key'], checkpoint['upload_id'])
+                checkpoint = None
+
+        uploaded = {}
+        if checkpoint is not None:
+            try:
+                uploaded = list_uploaded_parts(client, bucket, object_name, checkpoint['upload_id'])
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    raise
+                logging.info(f"Upload {checkpoint['upload_id']} no longer exists; restarting it.")
+                checkpoint = None
+
+        if checkpoint is None:
+            if part_size is None:
+                part_size = get_transfer_config(object_size=file_stat.st_size).multipart_chunksize
+            part_size = max(part_size, MIN_PART_SIZE, -(-file_stat.st_size // MAX_PARTS))
+            upload_id = client.create_multipart_upload(Bucket=bucket, Key=object_name)['UploadId']
+            checkpoint = dict(source, upload_id=upload_id, part_size=part_size, parts={})
+            write_atomically(checkpoint_path, json.dumps(checkpoint))
+
+        upload_id, part_size = checkpoint['upload_id'], checkpoint['part_size']
+        part_count = max(1, -(-file_stat.st_size // part_size))
+        part_sizes = {number: min(part_size, file_stat.st_size - (number - 1) * part_size)
+                      for number in range(1, part_count + 1)}
+        done = {number: part['ETag'] for number, part in uploaded.items()
+                if part_sizes.get(number) == part['Size']}
+        checkpoint['parts'] = {str(number): etag for number, etag in done.items()}
+        write_atomically(checkpoint_path, json.dumps(checkpoint))
+        missing = [number for number in part_sizes if number not in done]
+        if done:
+            logging.info(f"Resuming upload of '{file_name}': {len(done)}/{part_count} parts already stored.")
+
+        lock = threading.Lock()
+
+        def upload_part(number):
+            with open(file_name, 'rb') as f:
+                f.seek((number - 1) * part_size)
+                body = f.read(part_sizes[number])
+            response = client.upload_part(Bucket=bucket, Key=object_name, UploadId=upload_id,
+                                          PartNumber=number, Body=body)
+            with lock:
+                done[number] = response['ETag']
+                checkpoint['parts'][str(number)] = response['ETag']
+                write_atomically(checkpoint_path, json.dumps(checkpoint))
+
+        with CallSiteExecutor(max_workers=max_workers) as executor:
+            for future in [executor.submit(upload_part, number) for number in missing]:
+                future.result()
+
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=object_name, UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': done[number]} for number in sorted(done)]})
+        os.remove(checkpoint_path)
+        return True
+    except (ClientError, OSError, ValueError) as e:
+        logging.error(e)
+        return False
+
+
+def abort_multipart_upload(client, bucket, object_name, upload_id):
+    """Abort a multipart upload, discarding its stored parts
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: string
+    :param object_name: string
+    :param upload_id: string
+    :return: True if the upload was aborted or no longer exists, else False
+    """
+
+    try:
+        client.abort_multipart_upload(Bucket=bucket, Key=object_name, UploadId=upload_id)
         return True
     except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchUpload':
+            return True
         logging.error(e)
         return False
 
+
+def abort_stale_multipart_uploads(client, bucket_name, older_than=24 * 3600, prefix=None):
+    """Abort the multipart uploads of a bucket that were started long ago and never completed
+
+    Incomplete uploads keep their parts stored (and billed) until they are aborted.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: string
+    :param older_than: Minimum age, in seconds, of an upload to be aborted
+    :param prefix: Only consider uploads of keys beginning with this prefix
+    :return: List of (key, upload_id) tuples of the aborted uploads
+    """
+
+    cutoff = time.time() - older_than
+    kwargs = {'Bucket': bucket_name}
+    if prefix:
+        kwargs['Prefix'] = prefix
+
+    aborted = []
+    try:
+        while True:
+            response = client.list_multipart_uploads(**kwargs)
+            for upload in response.get('Uploads', []):
+                if upload['Initiated'].timestamp() < cutoff and \
+                        abort_multipart_upload(client, bucket_name, upload['Key'], upload['UploadId']):
+                    aborted.append((upload['Key'], upload['UploadId']))
+            if not response.get('IsTruncated'):
+                break
+            kwargs['KeyMarker'] = response['NextKeyMarker']
+            kwargs['UploadIdMarker'] = response['NextUploadIdMarker']
+    except ClientError as e:
+        logging.error(e)
+    logging.info(f"Aborted {len(aborted)} stale multipart uploads in '{bucket_name}'.")
+    return aborted
+
+#########################################################
+# Synchronization
+#########################################################
+
+def compute_local_etag(file_name, part_size=None):
+    """Compute the ETag S3 assigns to a file uploaded without SSE-KMS
+
+    A single PUT yields the MD5 of the content. A multipart upload yields the MD5 of the
+    concatenated binary MD5s of every part, followed by '-' and the number of parts.
+
+    :param file_name: File to hash
+    :param part_size: Part size of the multipart upload. If not specified, a single PUT is assumed
+    :return: ETag string, including the surrounding quotes S3 uses
+    """
+
+    whole = hashlib.md5()
+    part_digests = []
+    part = hashlib.md5()
+    part_filled = 0
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(MiB), b''):
+            if part_size is None:
+                whole.update(block)
+                continue
+            while block:
+                take = block[:part_size - part_filled]
+                part.update(take)
+                part_filled += len(take)
+                block = block[len(take):]
+                if part_filled == part_size:
+                    part_digests.append(part.digest())
+                    part, part_filled = hashlib.md5(), 0
+    if part_size is None:
+        return f'"{whole.hexdigest()}"'
+    if part_filled or not part_digests:
+        part_digests.append(part.digest())
+    return f'"{hashlib.md5(b"".join(part_digests)).hexdigest()}-{len(part_digests)}"'
+
+
+def local_file_matches_etag(file_name, etag, part_sizes=None):
+    """Check if the content of a local file matches the ETag of an S3 object
+
+    The part size of a multipart ETag is not recorded by S3, so it is guessed from the
+    given part sizes, the transfer profiles and the size implied by the part count.
+
+    :param file_name: Local file to compare
+    :param etag: ETag of the S3 object
+    :param part_sizes: Candidate multipart part sizes to try first
+    :return: True if the content matches, else False
+    """
+
+    etag = etag if etag.startswith('"') else f'"{etag}"'
+    if '-' not in etag:
+        return compute_local_etag(file_name) == etag
+
+    part_count = int(etag.strip('"').rsplit('-', 1)[1])
+    size = os.path.getsize(file_name)
+    candidates = list(part_sizes or [])
+    candidates += [profile['multipart_chunksize'] for profile in TRANSFER_PROFILES.values()]
+    candidates += [8 * MiB, -(-size // part_count // MiB) * MiB, -(-size // part_count)]
+    tried = set()
+    for part_size in candidates:
+        if part_size in tried or part_size <= 0 or max(1, -(-size // part_size)) != part_count:
+            continue
+        tried.add(part_size)
+        if compute_local_etag(file_name, part_size=part_size) == etag:
+            return True
+    return False
+
+
+def sync_directory_to_bucket(client, directory, bucket, prefix='', delete_orphans=False, always_hash=False,
+                             max_workers=16, transfer_profile='many-small'):
+    """Upload only the new or changed files of a directory tree to an S3 bucket
+
+    A local file is skipped when an object with the same key and size exists and either
+    the file was last modified before the object, or its content hash matches the ETag.
+    Note that objects encrypted with SSE-KMS do not have an MD5-based ETag, so their
+    content comparison always reports a change.
+
+    :param client: S3 Client used to connect with AWS
+    :param directory: Local directory to synchronize
+    :param bucket: Bucket to synchronize to
+    :param prefix: Prefix prepended to every key
+    :param delete_orphans: If True, delete objects under prefix with no matching local file
+    :param always_hash: If True, compare content hashes even when modification times agree
+    :param max_workers: Maximum number of files compared and uploaded at the same time
+    :param transfer_profile: Transfer profile used by the files above SINGLE_PUT_THRESHOLD
+    :return: dict with the 'uploaded', 'skipped', 'deleted' and 'failed' key lists
+    and the 'bytes_uploaded' and 'bytes_skipped' totals
+    """
+
+    root = os.path.abspath(directory)
+    local_files = {}
+    for path, _, names in os.walk(root):
+        for name in names:
+            file_name = os.path.join(path, name)
+            local_files[prefix + os.path.relpath(file_name, root).replace(os.sep, '/')] = file_name
+
+    remote_objects = {content['Key']: content for content in iter_objects_in_bucket(client, bucket, prefix=prefix)}
+    config = resolve_transfer_config(transfer_profile)
+    part_sizes = [config.multipart_chunksize] if config is not None else None
+
+    def is_unchanged(key):
+        remote = remote_objects.get(key)
+        if remote is None:
+            return False
+        file_stat = os.stat(local_files[key])
+        if file_stat.st_size != remote['Size']:
+            return False
+        if not always_hash and file_stat.st_mtime <= remote['LastModified'].timestamp():
+            return True
+        return local_file_matches_etag(local_files[key], remote['ETag'], part_sizes=part_sizes)
+
+    summary = {'uploaded': [], 'skipped': [], 'deleted': [], 'failed': [], 'bytes_uploaded': 0, 'bytes_skipped': 0}
+    with CallSiteExecutor(max_workers=max_workers) as executor:
+        keys = sorted(local_files)
+        to_upload = []
+        for key, unchanged in zip(keys, executor.map(is_unchanged, keys)):
+            if unchanged:
+                summary['skipped'].append(key)
+                summary['bytes_skipped'] += remote_objects[key]['Size']
+            else:
+                to_upload.append(key)
+
+        results = executor.map(
+            lambda key: upload_file_with_result(client, local_files[key], bucket, key,
+                                                transfer_profile=transfer_profile),
+            to_upload)
+        for result in results:
+            if result['error'] is None:
+                summary['uploaded'].append(result['key'])
+                summary['bytes_uploaded'] += result['bytes']
+            else:
+                summary['failed'].append(result['key'])
+
+    if delete_orphans:
+        orphans = sorted(key for key in remote_objects if key not in local_files)
+        if orphans and delete_objects_from_bucket(client, bucket, orphans):
+            summary['deleted'] = orphans
+
+    logging.info(f"Synchronized '{directory}' to '{bucket}': {len(summary['uploaded'])} uploaded, "
+                 f"{len(summary['skipped'])} unchanged, {len(summary['deleted'])} deleted, "
+                 f"{len(summary['failed'])} failed.")
+    return summary
+
 #########################################################
 # Download
 #########################################################
 
-def download_objects_from_bucket(client, bucket_name, object_list, directory_destiny):
+def download_objects_from_bucket(client, bucket_name, object_list, directory_destiny, transfer_profile=None,
+                                 max_workers=None):
     """Download objects from a bucket
 
     :param client: S3 Client used to connect with AWS
     :param bucket_name: string
-    :param object_list: list of strings
+    :param object_list: list of keys, or of listing dicts with 'Key' and 'Size'
     :param directory_destiny: string
+    :param transfer_profile: None, a TransferConfig, 'auto' or a name from TRANSFER_PROFILES. 'auto'
+    is tuned to each object's size, taken from the listing dicts or from a HeadObject
+    :param max_workers: If given, download concurrently with download_objects_concurrently, which
+    retries each object and keeps going when one of them fails
     :return: True if all objects were downloaded, else False
     """
 
+    if max_workers:
+        results, _ = download_objects_concurrently(client, bucket_name, object_list, directory_destiny,
+                                                   max_workers=max_workers, transfer_profile=transfer_profile)
+        return all(result['error'] is None for result in results)
+
     try:
         os.makedirs(os.path.dirname(directory_destiny), exist_ok=True)
-        file_name_list = [f"{directory_destiny}/{os.path.basename(object_name)}" for object_name in object_list]
-
-        for object_name, file_name in zip(object_list, file_name_list):
-            response = client.download_file(bucket_name, object_name, file_name)
+        cache = get_object_cache()
+        for item in object_list:
+            object_name, object_size = _split_object_item(item)
+            file_name = f"{directory_destiny}/{os.path.basename(object_name)}"
+            if cache is not None:
+                cache.copy_to(client, bucket_name, object_name, file_name)
+            else:
+                config = _resolve_object_transfer_config(client, bucket_name, object_name, transfer_profile,
+                                                         object_size)
+                response = client.download_file(bucket_name, object_name, file_name, Config=config)
             logging.info(f"Downloaded {object_name} to {file_name}")
         return True
-    except ClientError as e:
+    except (ClientError, BotoCoreError) as e:
         logging.error(e)
         return False
 
+NON_RETRYABLE_ERRORS = {'404', 'NoSuchKey', 'NoSuchBucket', '403', 'AccessDenied', 'InvalidObjectState'}
+
+
+def download_file_atomic(client, bucket_name, object_name, file_name, retries=3, backoff=0.5, config=None):
+    """Download an object to a temporary file and rename it into place, retrying on failure
+
+    The destination never holds a partially written object: either the previous content
+    stays in place or the complete new object replaces it. When a shared object cache is
+    set, the object is read through it.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: string
+    :param object_name: string
+    :param file_name: Local destination path
+    :param retries: Number of retries after the first attempt (missing or forbidden objects are not retried)
+    :param backoff: Seconds before the first retry, doubled (with jitter) on each retry
+    :param config: boto3 TransferConfig, or None for the defaults
+    :return: dict with 'key', 'file', 'bytes', 'seconds', 'attempts' and 'error' (None on success)
+    """
+
+    from s3transfer.exceptions import RetriesExceededError
+
+    result = {'key': object_name, 'file': file_name, 'bytes': 0, 'seconds': 0.0, 'attempts': 0, 'error': None}
+    start = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(file_name))
+    cache = get_object_cache()
+    for attempt in range(retries + 1):
+        result['attempts'] = attempt + 1
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_name)}.", suffix='.part')
+        os.close(fd)
+        try:
+            if cache is not None:
+                cache.copy_to(client, bucket_name, object_name, temp_name)
+            else:
+                client.download_file(bucket_name, object_name, temp_name, Config=config)
+            os.replace(temp_name, file_name)
+            result['bytes'] = os.path.getsize(file_name)
+            result['error'] = None
+            break
+        # Connection and streaming errors (BotoCoreError) and exhausted transfer retries are retried too
+        except (ClientError, BotoCoreError, RetriesExceededError, OSError) as e:
+            result['error'] = str(e)
+            code = e.response.get('Error', {}).get('Code') if isinstance(e, ClientError) else None
+            if code in NON_RETRYABLE_ERRORS or attempt == retries:
+                logging.error(f"Couldn't download {object_name}: {e}")
+                break
+            time.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+        finally:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def download_objects_concurrently(client, bucket_name, object_list, directory_destiny, max_workers=16, retries=3,
+                                  transfer_profile=None):
+    """Download objects from a bucket on a bounded thread pool
+
+    Each object is retried on its own and written atomically; a failed object is reported
+    in its result instead of cancelling the rest of the batch.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: string
+    :param object_list: list of keys, or of listing dicts with 'Key' and 'Size'
+    :param directory_destiny: string
+    :param max_workers: Maximum number of objects downloaded at the same time
+    :param retries: Number of retries per object
+    :param transfer_profile: None, a TransferConfig, 'auto' or a name from TRANSFER_PROFILES. 'auto'
+    is tuned to each object's size, taken from the listing dicts or from a HeadObject
+    :return: Tuple (list of per-object results from download_file_atomic, dict of aggregate stats)
+    """
+
+    os.makedirs(directory_destiny, exist_ok=True)
+    config = None if transfer_profile == 'auto' else resolve_transfer_config(transfer_profile)
+
+    def download(item):
+        object_name, object_size = _split_object_item(item)
+        file_name = os.path.join(directory_destiny, os.path.basename(object_name))
+        object_config = config
+        if transfer_profile == 'auto' and get_object_cache() is None:
+            object_config = _resolve_object_transfer_config(client, bucket_name, object_name, 'auto', object_size)
+        return download_file_atomic(client, bucket_name, object_name, file_name, retries=retries,
+                                    config=object_config)
+
+    start = time.perf_counter()
+    with CallSiteExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(download, object_list))
+    elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result['error'] is None]
+    total_bytes = sum(result['bytes'] for result in succeeded)
+    stats = {
+        'objects': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'bytes': total_bytes,
+        'seconds': elapsed,
+        'objects_per_second': len(succeeded) / elapsed if elapsed > 0 else 0.0,
+        'bytes_per_second': total_bytes / elapsed if elapsed > 0 else 0.0,
+    }
+    logging.info(f"Downloaded {stats['succeeded']}/{stats['objects']} objects ({total_bytes} bytes) "
+                 f"from '{bucket_name}' in {elapsed:.2f}s.")
+    return results, stats
+
+_seek_write_lock = threading.Lock()
+
+
+def _write_at(fd, data, offset):
+    """Write bytes at an offset of a file descriptor shared by several threads
+
+    os.pwrite leaves the file position untouched. Where it is missing (Windows), the
+    position is shared by every thread, so each seek and write pair holds a lock.
+    """
+
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data, offset = data[written:], offset + written
+    else:
+        with _seek_write_lock, open(fd, 'r+b', closefd=False) as f:
+            f.seek(offset)
+            f.write(data)
+
+
+def _preallocate(fd, size):
+    """Reserve size bytes for a file, falling back to a sparse ftruncate where fallocate is unsupported"""
+    if hasattr(os, 'posix_fallocate') and size:
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            # e.g., filesystems without fallocate support (EOPNOTSUPP) or some network mounts (EINVAL)
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                raise
+    os.ftruncate(fd, size)
+
+
+def download_object_ranged(client, bucket_name, object_name, file_name, part_size=None, max_workers=16,
+                           retries=3, verify_checksum=True):
+    """Download a single large object with concurrent byte-range GETs
+
+    The destination is preallocated to the object size and every range is written in
+    place with os.pwrite, so no part needs to be reassembled afterwards. Each GET carries
+    If-Match with the ETag from the initial HeadObject, so all ranges come from the same
+    version of the object, and each range is checked to have exactly the expected length.
+    With verify_checksum, the assembled file is finally compared against the ETag.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: string
+    :param object_name: string
+    :param file_name: Local destination path, replaced atomically once complete
+    :param part_size: Bytes per range. If not specified, get_transfer_config chooses it
+    :param max_workers: Maximum number of ranges downloaded at the same time
+    :param retries: Number of retries per range
+    :param verify_checksum: If True, compare the MD5-based ETag of the file with the object's
+    :return: dict with 'key', 'file', 'bytes', 'seconds', 'ranges', 'verified' and 'error' (None on success)
+    """
+
+    result = {'key': object_name, 'file': file_name, 'bytes': 0, 'seconds': 0.0, 'ranges': 0,
+              'verified': False, 'error': None}
+    start = time.perf_counter()
+    temp_name = None
+    try:
+        head = client.head_object(Bucket=bucket_name, Key=object_name)
+        size, etag = head['ContentLength'], head['ETag']
+        if part_size is None:
+            part_size = get_transfer_config(object_size=size).multipart_chunksize
+        ranges = [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+        result['ranges'] = len(ranges)
+
+        directory = os.path.dirname(os.path.abspath(file_name))
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_name)}.", suffix='.part')
+        try:
+            _preallocate(fd, size)
+
+            def download_range(offset_and_length):
+                offset, length = offset_and_length
+                for attempt in range(retries + 1):
+                    try:
+                        response = client.get_object(Bucket=bucket_name, Key=object_name, IfMatch=etag,
+                                                     Range=f"bytes={offset}-{offset + length - 1}")
+                        received = 0
+                        for chunk in iter(lambda: response['Body'].read(MiB), b''):
+                            _write_at(fd, chunk, offset + received)
+                            received += len(chunk)
+                        if received != length:
+                            raise IOError(f"Range at {offset} returned {received} of {length} bytes")
+                        return
+                    # Mid-stream and connection failures are BotoCoreErrors, not IOErrors
+                    except (ClientError, BotoCoreError, IOError) as e:
+                        code = e.response.get('Error', {}).get('Code') if isinstance(e, ClientError) else None
+                        if code in NON_RETRYABLE_ERRORS or code == 'PreconditionFailed' or attempt == retries:
+                            raise
+                        time.sleep(0.5 * 2 ** attempt * (0.5 + random.random()))
+
+            with CallSiteExecutor(max_workers=max_workers) as executor:
+                for future in [executor.submit(download_range, byte_range) for byte_range in ranges]:
+                    future.result()
+        finally:
+            os.close(fd)
+
+        if verify_checksum and head.get('ServerSideEncryption') != 'aws:kms':
+            result['verified'] = local_file_matches_etag(temp_name, etag, part_sizes=[part_size])
+            if not result['verified']:
+                if '-' not in etag:
+                    raise IOError(f"Checksum of {object_name} does not match its ETag {etag}")
+                logging.warning(f"Couldn't verify {object_name} against multipart ETag {etag}: unknown part size.")
+
+        os.replace(temp_name, file_name)
+        temp_name = None
+        result['bytes'] = size
+    except (ClientError, BotoCoreError, OSError) as e:
+        logging.error(f"Couldn't download {object_name}: {e}")
+        result['error'] = str(e)
+    finally:
+        if temp_name is not None and os.path.exists(temp_name):
+            os.remove(temp_name)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+#########################################################
+# Streaming Read
+#########################################################
+
+# Schema of the ticker history produced by on_premise_ingestion and dataset_generator
+TICKER_HISTORY_DTYPES = {
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'Volume': 'int64',
+    'Dividends': 'float64',
+    'Stock Splits': 'float64',
+    'Ticker': 'string',
+}
+
+
+class _StreamingBodyReader(io.RawIOBase):
+    """Expose a GetObject StreamingBody as a raw stream, so it can be buffered and decompressed"""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.body.close()
+        super().close()
+
+
+def read_object_as_dataframe(client, bucket, object_name, file_format=None, chunksize=None, columns=None,
+                             dtype=None, parse_dates=True, buffer_size=MiB):
+    """Read an object into pandas without writing it to a local file
+
+    CSV objects (optionally gzip, bz2, xz or zstd compressed) are parsed incrementally from
+    the GetObject body stream; with chunksize, a generator of DataFrames with at most
+    chunksize rows is returned, so an object of any size is processed in bounded memory.
+    Parquet objects are read with ranged GETs; with chunksize, they are returned as batches of
+    at most chunksize rows (pyarrow iter_batches), which may span row group boundaries.
+    Objects are read through the shared object cache when one is set.
+
+    The ticker history layout (Date index; Open, High, Low, Close, Volume, Dividends,
+    Stock Splits and Ticker columns) is parsed with TICKER_HISTORY_DTYPES by default.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket: string
+    :param object_name: string
+    :param file_format: 'csv' or 'parquet'. If not specified, it is guessed from the key suffix
+    :param chunksize: Rows per DataFrame batch. If not specified, a single DataFrame is returned
+    :param columns: Columns to read. If not specified, every column is read
+    :param dtype: CSV column types. If not specified, the known ticker history columns are typed
+    :param parse_dates: If True, parse the first CSV column (Date) as the DataFrame index
+    :param buffer_size: Bytes requested from the stream at a time
+    :return: DataFrame, or generator of DataFrames when chunksize is given
+    """
+
+    import pandas as pd
+
+    if file_format is None:
+        file_format = 'parquet' if '.parquet' in object_name else 'csv'
+    cache = get_object_cache()
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        reader = cache.open(client, bucket, object_name) if cache is not None \
+            else io.BufferedReader(S3RangeReader(client, bucket, object_name), buffer_size)
+        parquet_file = pq.ParquetFile(reader)
+        if chunksize is None:
+            with reader:
+                return parquet_file.read(columns=columns).to_pandas()
+
+        def iter_batches():
+            with reader:
+                for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+                    yield batch.to_pandas()
+        return iter_batches()
+
+    compression = next((codec for codec, suffix in COMPRESSION_SUFFIXES.items()
+                        if codec is not None and object_name.endswith(suffix)), None)
+    if cache is not None:
+        stream = cache.open(client, bucket, object_name)
+    else:
+        response = client.get_object(Bucket=bucket, Key=object_name)
+        stream = io.BufferedReader(_StreamingBodyReader(response['Body']), buffer_size)
+
+    if dtype is None:
+        dtype = TICKER_HISTORY_DTYPES
+    usecols = None
+    if columns is not None:
+        usecols = lambda column: column in columns or (parse_dates and column == 'Date')
+    reader = pd.read_csv(stream, compression=compression, chunksize=chunksize, usecols=usecols, dtype=dtype,
+                         index_col=0 if parse_dates else None, parse_dates=parse_dates)
+    if chunksize is None:
+        with stream:
+            return reader
+
+    def iter_chunks():
+        with stream, reader:
+            yield from reader
+    return iter_chunks()
+
 #########################################################
 # Deletion
 #########################################################
 
-def delete_objects_from_bucket(client, bucket_name, object_list):
+DELETE_BATCH_SIZE = 1000
+
+
+def _delete_batch(client, bucket_name, batch, retries=3, backoff=0.5):
+    """Delete up to 1000 objects with one DeleteObjects request, retrying only the failed keys
+
+    :param batch: list of keys, or of dicts with 'Key' and optionally 'VersionId'
+    :return: Tuple (number of deleted objects, list of error dicts with 'Key', 'Code' and 'Message')
+    """
+
+    pending = [{'Key': item} if isinstance(item, str) else item for item in batch]
+    failed = []
+    for attempt in range(retries + 1):
+        try:
+            response = client.delete_objects(Bucket=bucket_name, Delete={'Objects': pending, 'Quiet': True})
+            errors = response.get('Errors', [])
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in NON_RETRYABLE_ERRORS or attempt == retries:
+                message = e.response.get('Error', {}).get('Message', str(e))
+                failed += [dict(item, Code=code, Message=message) for item in pending]
+                break
+            errors = [dict(item, Code=code) for item in pending]
+        except BotoCoreError as e:
+            # Connection and streaming errors fail the whole request; every pending key is retried
+            if attempt == retries:
+                failed += [dict(item, Code=type(e).__name__, Message=str(e)) for item in pending]
+                break
+            errors = [dict(item, Code=type(e).__name__) for item in pending]
+
+        retryable = [error for error in errors if error.get('Code') not in NON_RETRYABLE_ERRORS]
+        failed += [error for error in errors if error.get('Code') in NON_RETRYABLE_ERRORS]
+        if not retryable:
+            pending = []
+            break
+        if attempt == retries:
+            failed += retryable
+            pending = []
+            break
+        retry_ids = {(error['Key'], error.get('VersionId')) for error in retryable}
+        pending = [item for item in pending if (item['Key'], item.get('VersionId')) in retry_ids]
+        time.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+    return len(batch) - len(failed), failed
+
+
+def delete_objects_batched(client, bucket_name, objects, max_workers=8, batch_size=DELETE_BATCH_SIZE, retries=3,
+                           on_batch=None):
+    """Delete any number of objects in concurrent 1000-key DeleteObjects batches
+
+    The objects are consumed lazily, so a generator such as iter_keys_in_bucket can feed
+    the deletion while it is still listing; at most two batches per worker are buffered.
+    Requests use Quiet mode, so only the failed keys come back, and only those are retried.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: string
+    :param objects: Iterable of keys, or of dicts with 'Key' and optionally 'VersionId'
+    :param max_workers: Maximum number of DeleteObjects requests in flight
+    :param batch_size: Keys per request (S3 accepts at most 1000)
+    :param retries: Number of retries of the failed keys of each batch
+    :param on_batch: Optional function called with (deleted, failed) counts after each batch
+    :return: dict with 'deleted', 'failed' (list of error dicts), 'batches' and 'seconds'
+    """
+
+    if isinstance(objects, (str, bytes)):
+        raise TypeError("objects must be an iterable of keys, not a string")
+    batch_size = min(batch_size, DELETE_BATCH_SIZE)
+
+    report = {'deleted': 0, 'failed': [], 'batches': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+
+    def collect(done):
+        for future in done:
+            deleted, failed = future.result()
+            report['deleted'] += deleted
+            report['failed'] += failed
+            report['batches'] += 1
+            if on_batch is not None:
+                on_batch(deleted, len(failed))
+
+    iterator = iter(objects)
+    with CallSiteExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for batch in iter(lambda: list(itertools.islice(iterator, batch_size)), []):
+            in_flight.add(executor.submit(_delete_batch, client, bucket_name, batch, retries))
+            if len(in_flight) >= 2 * max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(in_flight)
+
+    report['seconds'] = time.perf_counter() - start
+    for error in report['failed'][:10]:
+        logging.error(f"Couldn't delete {error['Key']}: {error.get('Code')} {error.get('Message', '')}")
+    return report
+
+
+def delete_objects_from_bucket(client, bucket_name, object_list, max_workers=8):
     """Delete objects from a bucket
 
     :param client: S3 Client used to connect with AWS
     :param bucket_name: string
-    :param object_list: list of strings
+    :param object_list: list, or any iterable (e.g., a generator) of strings
+    :param max_workers: Maximum number of 1000-key batches deleted at the same time
     :return: True if all objects were deleted, else False
     """
-    if not isinstance(object_list, list):
-        raise TypeError("object_list must be a list")
-    if len(object_list) == 0:
+    if isinstance(object_list, (str, bytes)) or not hasattr(object_list, '__iter__'):
+        raise TypeError("object_list must be an iterable of keys")
+    if hasattr(object_list, '__len__') and len(object_list) == 0:
         raise ValueError("object_list must not be empty")
 
     try:
-        if len(object_list) == 1:
-            response = client.delete_object(Bucket=bucket_name, Key=object_list[0])
-        elif len(object_list) > 1:
-            Objects = [{'Key': k} for k in object_list]
-
-            response = client.delete_objects(
-                Bucket=bucket_name,
-                Delete={
-                    'Objects': Objects,
-                    'Quiet': False
-                }
-            )
-        return True
-    except Exception as e:
+        report = delete_objects_batched(client, bucket_name, object_list, max_workers=max_workers)
+    except (ClientError, BotoCoreError) as e:
+        # e.g., raised by a generator listing the keys
         logging.error(e)
         return False
+    return not report['failed']
+
+
+def iter_object_versions(client, bucket_name, prefix=None, page_size=1000, prefetch=True):
+    """Lazily iterate over every object version and delete marker of a bucket
+
+    Works on unversioned buckets too, where every object has the version 'null'. As with
+    iter_list_objects_pages, the next page is fetched while the current one is consumed.
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: string
+    :param prefix: Only list keys beginning with this prefix
+    :param page_size: Maximum number of versions per request
+    :param prefetch: If True, fetch the next page while the current one is being consumed
+    :return: Generator of dicts with 'Key' and 'VersionId'
+    """
 
+    kwargs = {'Bucket': bucket_name, 'MaxKeys': page_size}
+    if prefix:
+        kwargs['Prefix'] = prefix
 
-def nuke_bucket(client, bucket_name):
+    def fetch(markers):
+        return client.list_object_versions(**kwargs, **markers)
+
+    def next_markers(response):
+        if not response.get('IsTruncated'):
+            return None
+        markers = {'KeyMarker': response['NextKeyMarker']}
+        if response.get('NextVersionIdMarker'):
+            markers['VersionIdMarker'] = response['NextVersionIdMarker']
+        return markers
+
+    with CallSiteExecutor(max_workers=1) as executor:
+        markers = {}
+        future = executor.submit(fetch, markers) if prefetch else None
+        while markers is not None:
+            response = future.result() if prefetch else fetch(markers)
+            markers = next_markers(response)
+            if prefetch and markers is not None:
+                future = executor.submit(fetch, markers)
+            for version in response.get('Versions', []) + response.get('DeleteMarkers', []):
+                yield {'Key': version['Key'], 'VersionId': version['VersionId']}
+
+
+def nuke_bucket(client, bucket_name, max_workers=8, progress_interval=10.0, stats=None):
     """Delete all objects in a bucket and then the bucket itself
+
+    Listing and deletion are pipelined: object versions and delete markers are listed page
+    by page and handed to concurrent 1000-key DeleteObjects batches as the pages arrive.
+    Incomplete multipart uploads are aborted, and the bucket is only deleted once a new
+    listing confirms that it is empty.
     
     :param client: S3 Client used to connect with AWS
     :param bucket_name: Bucket to delete
+    :param max_workers: Maximum number of DeleteObjects requests in flight
+    :param progress_interval: Seconds between progress log messages
+    :param stats: Optional dict filled with 'deleted', 'failed', 'seconds' and 'objects_per_second'
     :return: True if bucket and all objects deleted, else False
     """
 
+    if stats is None:
+        stats = {}
+    stats.update(deleted=0, failed=0, seconds=0.0, objects_per_second=0.0)
+    start = time.perf_counter()
+    last_report = [start]
+
+    def on_batch(deleted, failed):
+        stats['deleted'] += deleted
+        stats['failed'] += failed
+        now = time.perf_counter()
+        if now - last_report[0] >= progress_interval:
+            last_report[0] = now
+            logging.info(f"Nuking '{bucket_name}': {stats['deleted']} versions deleted "
+                         f"({stats['deleted'] / (now - start):.0f}/s).")
+
     try:
-        objects = get_list_objects_in_bucket(client, bucket_name)
-        delete_objects_from_bucket(client, bucket_name, objects)
-        delete_bucket(client, bucket_name)
-        logging.info(f"Bucket '{bucket_name}' and all it's {len(objects)} objects were deleted.")
-        return True
-    except ClientError as e:
+        for _ in range(3):
+            delete_objects_batched(client, bucket_name, iter_object_versions(client, bucket_name),
+                                   max_workers=max_workers, on_batch=on_batch)
+            abort_stale_multipart_uploads(client, bucket_name, older_than=0)
+            remaining = client.list_object_versions(Bucket=bucket_name, MaxKeys=1)
+            if not remaining.get('Versions') and not remaining.get('DeleteMarkers'):
+                break
+        else:
+            logging.error(f"Bucket '{bucket_name}' is still not empty; it was not deleted.")
+            return False
+    except (ClientError, BotoCoreError) as e:
         logging.error(e)
         return False
+    finally:
+        stats['seconds'] = time.perf_counter() - start
+        stats['objects_per_second'] = stats['deleted'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+
+    if not delete_bucket(client, bucket_name):
+        return False
+    logging.info(f"Bucket '{bucket_name}' and all it's {stats['deleted']} object versions were deleted "
+                 f"in {stats['seconds']:.2f}s ({stats['objects_per_second']:.0f}/s).")
+    return True
 
 
 def delete_bucket(client, bucket_name):
@@ -217,6 +2074,8 @@ def delete_bucket(client, bucket_name):
     except Exception as e:
         logging.error(e)
         return False
+    finally:
+        invalidate_bucket_cache(bucket_name)
     
 #########################################################
 # Policies
@@ -352,25 +2211,270 @@ def delete_bucket_cors(client, bucket_name):
         logging.error(e)
         return None
 
+#########################################################
+# Declarative Bucket Configuration
+#########################################################
+
+# Grantee URIs of the S3 predefined groups
+ALL_USERS_URI = 'http://acs.amazonaws.com/groups/global/AllUsers'
+AUTHENTICATED_USERS_URI = 'http://acs.amazonaws.com/groups/global/AuthenticatedUsers'
+# Grants, besides the owner's FULL_CONTROL, of the canned ACLs that can be compared to GetBucketAcl
+CANNED_ACL_GRANTS = {
+    'private': [],
+    'public-read': [(ALL_USERS_URI, 'READ')],
+    'public-read-write': [(ALL_USERS_URI, 'READ'), (ALL_USERS_URI, 'WRITE')],
+    'authenticated-read': [(AUTHENTICATED_USERS_URI, 'READ')],
+}
+BUCKET_CONFIGURATION_ASPECTS = ('cors', 'policy', 'acl')
+
+
+def _normalize_json(value):
+    """Canonical form of a JSON document: keys sorted, one-element lists unwrapped, list items sorted"""
+    if isinstance(value, dict):
+        return {key: _normalize_json(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        items = sorted((_normalize_json(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+        return items[0] if len(items) == 1 else items
+    return value
+
+
+def normalize_bucket_policy(policy):
+    """Canonical form of a bucket policy, so that equivalent policies compare equal
+
+    :param policy: Policy as a JSON string or a dict, or None for no policy
+    :return: dict, or None
+    """
+
+    if policy is None:
+        return None
+    if isinstance(policy, str):
+        policy = json.loads(policy)
+    return _normalize_json(policy)
+
+
+def normalize_cors_rules(rules):
+    """Canonical form of CORS rules; the order of the rules is kept since the first match applies
+
+    :param rules: list of CORS rules, a CORSConfiguration dict with 'CORSRules', or None for no CORS
+    :return: list of dicts (empty for no CORS)
+    """
+
+    if isinstance(rules, dict):
+        rules = rules.get('CORSRules', [])
+    return [{key: sorted(value) if isinstance(value, list) else value for key, value in sorted(rule.items())}
+            for rule in rules or []]
+
+
+def normalize_acl_grants(grants, owner_id=None):
+    """Canonical form of an ACL: sorted (grantee, permission) pairs
+
+    :param grants: list of grants as returned by get_bucket_acl, or a canned ACL name of CANNED_ACL_GRANTS
+    :param owner_id: Canonical user ID of the bucket owner, required by canned ACL names
+    :return: sorted list of (grantee, permission) tuples
+    """
+
+    if isinstance(grants, str):
+        if grants not in CANNED_ACL_GRANTS:
+            raise ValueError(f"Unsupported canned ACL '{grants}'. Use grants or one of {sorted(CANNED_ACL_GRANTS)}.")
+        return sorted([(owner_id, 'FULL_CONTROL')] + CANNED_ACL_GRANTS[grants])
+    pairs = []
+    for grant in grants:
+        grantee = grant['Grantee']
+        pairs.append((grantee.get('ID') or grantee.get('URI') or grantee.get('EmailAddress'), grant['Permission']))
+    return sorted(pairs)
+
+
+def get_bucket_configuration(client, bucket_name, aspects=BUCKET_CONFIGURATION_ASPECTS):
+    """Fetch the CORS rules, policy and ACL of a bucket, telling a missing configuration from an error
+
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: string
+    :param aspects: Iterable of 'cors', 'policy' and 'acl'
+    :return: dict with the requested aspects: 'cors' (list of rules, empty if none), 'policy'
+    (JSON string, or None if none) and 'acl' (dict with 'Owner' and 'Grants')
+    :raise ClientError: If a configuration cannot be read
+    """
+
+    configuration = {}
+    if 'cors' in aspects:
+        try:
+            configuration['cors'] = client.get_bucket_cors(Bucket=bucket_name)['CORSRules']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchCORSConfiguration':
+                raise
+            configuration['cors'] = []
+    if 'policy' in aspects:
+        try:
+            configuration['policy'] = client.get_bucket_policy(Bucket=bucket_name)['Policy']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchBucketPolicy':
+                raise
+            configuration['policy'] = None
+    if 'acl' in aspects:
+        response = client.get_bucket_acl(Bucket=bucket_name)
+        configuration['acl'] = {'Owner': response['Owner'], 'Grants': response['Grants']}
+    return configuration
+
+
+def diff_bucket_configuration(current, desired):
+    """List the aspects whose desired state differs from the current one
+
+    :param current: dict as returned by get_bucket_configuration
+    :param desired: dict with any of 'cors', 'policy' and 'acl'; see apply_bucket_configurations
+    :return: list of the aspects that need a change
+    """
+
+    changes = []
+    if 'cors' in desired and normalize_cors_rules(desired['cors']) != normalize_cors_rules(current['cors']):
+        changes.append('cors')
+    if 'policy' in desired and normalize_bucket_policy(desired['policy']) != normalize_bucket_policy(current['policy']):
+        changes.append('policy')
+    if desired.get('acl') is not None:
+        owner_id = current['acl']['Owner'].get('ID')
+        if normalize_acl_grants(desired['acl'], owner_id) != normalize_acl_grants(current['acl']['Grants']):
+            changes.append('acl')
+    return changes
+
+
+def _apply_bucket_aspect(client, bucket_name, aspect, desired, owner):
+    """PUT (or DELETE, for an absent CORS or policy) one aspect of a bucket configuration"""
+    if aspect == 'cors':
+        rules = normalize_cors_rules(desired)
+        if rules:
+            client.put_bucket_cors(Bucket=bucket_name, CORSConfiguration={'CORSRules': rules})
+        else:
+            client.delete_bucket_cors(Bucket=bucket_name)
+    elif aspect == 'policy':
+        if desired is None:
+            client.delete_bucket_policy(Bucket=bucket_name)
+        else:
+            client.put_bucket_policy(Bucket=bucket_name,
+                                     Policy=desired if isinstance(desired, str) else json.dumps(desired))
+    elif isinstance(desired, str):
+        client.put_bucket_acl(Bucket=bucket_name, ACL=desired)
+    else:
+        client.put_bucket_acl(Bucket=bucket_name, AccessControlPolicy={'Owner': owner, 'Grants': desired})
+
+
+def _reconcile_bucket(client, bucket_name, desired, dry_run):
+    """Fetch the current configuration of a bucket and apply the aspects that differ
+
+    :return: list of the changed aspects
+    """
+
+    aspects = [aspect for aspect in BUCKET_CONFIGURATION_ASPECTS if aspect in desired]
+    current = get_bucket_configuration(client, bucket_name, aspects)
+    changes = diff_bucket_configuration(current, desired)
+    if not dry_run:
+        owner = current.get('acl', {}).get('Owner')
+        for aspect in changes:
+            _apply_bucket_aspect(client, bucket_name, aspect, desired[aspect], owner)
+    return changes
+
+
+def apply_bucket_configurations(client, desired_states, max_workers=16, dry_run=False):
+    """Bring the CORS rules, policies and ACLs of many buckets to a desired state
+
+    Buckets are reconciled concurrently: the current configuration is fetched and compared
+    to the desired one after normalization, and only the aspects that really differ are
+    written, so re-applying an unchanged configuration costs reads only.
+
+    :param client: S3 Client used to connect with AWS
+    :param desired_states: dict mapping bucket names to a dict with any of:
+        'cors': list of CORS rules (or a CORSConfiguration dict); empty or None removes the CORS
+        'policy': policy as a JSON string or a dict; None removes the policy
+        'acl': canned ACL name (see CANNED_ACL_GRANTS) or a list of grants
+    Aspects left out are not managed.
+    :param max_workers: Maximum number of buckets reconciled at the same time
+    :param dry_run: If True, only report what would change
+    :return: dict with 'changed' (bucket -> list of changed aspects), 'unchanged' (list of
+    buckets) and 'failed' (bucket -> error message)
+    """
+
+    summary = {'changed': {}, 'unchanged': [], 'failed': {}}
+    with CallSiteExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_reconcile_bucket, client, bucket_name, desired, dry_run): bucket_name
+                   for bucket_name, desired in desired_states.items()}
+        for future in futures:
+            bucket_name = futures[future]
+            try:
+                changes = future.result()
+            # KeyError and TypeError come from desired states or grants of an unexpected shape
+            except (ClientError, BotoCoreError, ValueError, KeyError, TypeError) as e:
+                message = repr(e) if isinstance(e, KeyError) else str(e)
+                logging.error(f"Couldn't configure bucket {bucket_name}: {message}")
+                summary['failed'][bucket_name] = message
+                continue
+            if changes:
+                summary['changed'][bucket_name] = changes
+            else:
+                summary['unchanged'].append(bucket_name)
+
+    logging.info(f"{'Would change' if dry_run else 'Changed'} {len(summary['changed'])} buckets, "
+                 f"{len(summary['unchanged'])} unchanged, {len(summary['failed'])} failed.")
+    return summary
+
 #########################################################
 # Auxiliary Functions
 #########################################################
 
-def on_premise_ingestion(ticker_list, directory):
-    """Ingest data on-premise from yfinance data sources
+def iter_ticker_history(ticker_list, delay=3):
+    """Download the daily history of each ticker from yfinance
 
     :param ticker_list: list of strings
-    :param directory: string
+    :param delay: Seconds to wait between tickers
+    :return: Generator of (ticker, DataFrame) tuples
     """
 
-    os.makedirs(os.path.dirname(directory), exist_ok=True)
-    financial_data = []
+    import yfinance as yf
+
     for ticker in ticker_list:
         data = yf.Ticker(ticker).history(period="max", interval="1d")
-        financial_data.append(data)
-        data.to_csv(f"./{directory}/{ticker}.csv")
+        yield ticker, data
         print(f"Ingested data from ticker '{ticker}'")
-        time.sleep(3)
+        time.sleep(delay)
+
+
+def on_premise_ingestion(ticker_list, directory, client=None, bucket=None, file_format='csv', compression=None,
+                         pack_target_size=None):
+    """Ingest data on-premise from yfinance data sources
+
+    If a client and a bucket are given, each ticker is uploaded straight from memory with
+    upload_dataframe (under the directory name as prefix) instead of being written to disk.
+    If pack_target_size is also given, the tickers are packed into objects of about that
+    size with pack_dataframes_to_bucket instead of one object per ticker; packed objects are
+    not compressed, so compression cannot be combined with pack_target_size.
+
+    :param ticker_list: list of strings
+    :param directory: string
+    :param client: S3 Client used to connect with AWS
+    :param bucket: Bucket to upload the data to
+    :param file_format: 'csv' or 'parquet', used when uploading
+    :param compression: A codec of DATAFRAME_COMPRESSIONS for the format, used when uploading: None,
+    'gzip', 'bz2', 'xz' or 'zstd' for CSV, None, 'snappy', 'gzip', 'brotli', 'lz4' or 'zstd' for Parquet
+    :param pack_target_size: Size in bytes of the packed objects, used when uploading
+    """
+
+    upload = client is not None and bucket is not None
+    if upload and pack_target_size and compression is not None:
+        raise ValueError("Packed objects are not compressed; use compression or pack_target_size, not both.")
+    if upload and not pack_target_size:
+        validate_dataframe_format(file_format, compression)
+    if not upload:
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+    prefix = os.path.basename(os.path.normpath(directory)).lstrip('.')
+    if upload and pack_target_size:
+        pack_dataframes_to_bucket(client, iter_ticker_history(ticker_list), bucket,
+                                  prefix=f"{prefix}/" if prefix else '', target_size=pack_target_size,
+                                  file_format=file_format)
+        return
+
+    for ticker, data in iter_ticker_history(ticker_list):
+        if upload:
+            upload_dataframe(client, data, bucket, f"{prefix}/{ticker}" if prefix else ticker,
+                             file_format=file_format, compression=compression)
+        else:
+            data.to_csv(f"./{directory}/{ticker}.csv")
 
 
 def get_absolute_file_paths_and_names(directory):
@@ -395,6 +2499,9 @@ def print_line(message):
 #########################################################
 
 def usage_demo():
+    from client_factory import get_client
+    from dotenv import load_dotenv
+
     print_line("Beginning of Amazon S3 bucket functionalities demonstration")
 
     # Redirects the logging output to a file AND to the console
@@ -415,15 +2522,25 @@ def usage_demo():
     AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
     bucket_name = "dms-nasdaq"
     tickers = ["AMZN", "AAPL", "TSLA", "GOOG", "NFLX"]
-    upload_directory = "./files_to_upload/"
+    upload_folder = "./files_to_upload/"
     download_directory = "./downloaded_files/"
-    s3_client = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+    # Standard (not adaptive) retries, so only the AIMD controller below slows down on throttling
+    s3_client = get_client('s3', max_concurrency=64, retries={'mode': 'standard', 'max_attempts': 10},
+                           aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+    concurrency_controller = register_adaptive_concurrency(s3_client)
+    # Opt-in per-call metrics, written at the end as Prometheus text ('.prom') or JSON
+    metrics_file = os.getenv('AWS_METRICS_FILE')
+    if metrics_file:
+        instrument_client(s3_client)
+    # Opt-in request and cost ledger of the run, written at the end as JSON
+    ledger_file = os.getenv('AWS_COST_LEDGER_FILE')
+    if ledger_file:
+        track_client(s3_client)
 
     # Ingest data on premise
     print_line("Ingesting data on premise")
 
-    on_premise_ingestion(ticker_list=tickers, directory=upload_directory)
-    abs_file_paths, file_names = get_absolute_file_paths_and_names(upload_directory)
+    on_premise_ingestion(ticker_list=tickers, directory=upload_folder)
 
     # Create bucket and verify that it is created
     print_line("Bucket creation + verification")
@@ -439,8 +2556,9 @@ def usage_demo():
     object_list = get_list_objects_in_bucket(s3_client, bucket_name=bucket_name)
     print(f"List of objects in bucket (BEFORE): {object_list}")
     print("Uploading files to bucket...")
-    for file in abs_file_paths:
-        upload_file(s3_client, file, bucket_name)
+    upload_results, upload_stats = upload_directory(s3_client, upload_folder, bucket_name)
+    print(f"Uploaded {upload_stats['succeeded']} of {upload_stats['files']} files "
+          f"({upload_stats['bytes_per_second'] / 1024 ** 2:.2f} MiB/s).")
     object_list = get_list_objects_in_bucket(s3_client, bucket_name=bucket_name)
     print(f"List of objects in bucket (AFTER): {object_list}")
 
@@ -517,6 +2635,14 @@ def usage_demo():
     print_line("Delete bucket and all it's contents")
     nuke_bucket(s3_client, bucket_name)
 
+    print(f"Adaptive concurrency windows: {json.dumps(concurrency_controller.get_metrics(), indent=4)}")
+    if metrics_file:
+        write_metrics(metrics_file)
+        print(f"API call metrics written to {metrics_file}")
+    if ledger_file:
+        print(get_cost_ledger().format_report())
+        write_ledger(ledger_file)
+
     print_line("End of Amazon S3 bucket functionalities demonstration")
 
 #%%
@@ -0,0 +1,251 @@
+""" Opt-in latency and byte instrumentation of boto3 clients through botocore events.
+
+Once a client is instrumented, every API call it makes is recorded per service and
+operation: a latency histogram, the number of retries, the bytes sent and received
+(from the Content-Length headers) and the HTTP status codes. Works for any service,
+e.g., S3, Glue and Athena clients.
+
+The metrics can be written as a Prometheus text file (for the node_exporter textfile
+collector) or as a JSON snapshot with estimated percentiles.
+
+Usage:
+    instrument_client(s3_client)
+    nuke_bucket(s3_client, bucket_name)
+    write_metrics("metrics.json")
+"""
+
+#%%
+import json
+import threading
+import time
+from file_utils import write_atomically
+
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+class OperationMetrics:
+    """Metrics of a single service operation"""
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.status_counts = {}
+
+    def observe(self, latency, status, retries, bytes_sent, bytes_received):
+        for i, upper_bound in enumerate(LATENCY_BUCKETS):
+            if latency <= upper_bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.latency_sum += latency
+        self.retries += retries
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def percentile(self, quantile):
+        """Estimate a latency percentile by interpolating inside the histogram bucket that holds it"""
+        if self.count == 0:
+            return None
+        rank = quantile * self.count
+        cumulative = 0
+        for i, count in enumerate(self.bucket_counts):
+            if cumulative + count >= rank and count:
+                lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                upper = LATENCY_BUCKETS[i] if LATENCY_BUCKETS[i] != float('inf') else lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return LATENCY_BUCKETS[-2]
+
+
+class MetricsRegistry:
+    """Thread-safe collection of OperationMetrics, fed by the botocore events of instrumented clients"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._local = threading.local()
+
+    #########################################################
+    # Event Handlers
+    #########################################################
+
+    def instrument(self, client):
+        """Register the event handlers on a client
+
+        :param client: boto3 client of any service
+        """
+
+        service_id = client.meta.service_model.service_id.hyphenize()
+        events = client.meta.events
+        unique_id = f"instrumentation-{id(self)}"
+        events.register(f'before-call.{service_id}', self._before_call, unique_id=f"{unique_id}-before-call")
+        events.register(f'before-send.{service_id}', self._before_send, unique_id=f"{unique_id}-before-send")
+        events.register(f'after-call.{service_id}', self._after_call, unique_id=f"{unique_id}-after-call")
+        events.register(f'after-call-error.{service_id}', self._after_call_error,
+                        unique_id=f"{unique_id}-after-call-error")
+
+    def _before_call(self, model, context, **kwargs):
+        context['instrumentation_model'] = model
+        context['instrumentation_start'] = time.perf_counter()
+        self._local.bytes_sent = 0
+
+    def _before_send(self, request, **kwargs):
+        # Called once per attempt, so retried bodies are counted every time they are sent
+        self._local.bytes_sent = getattr(self._local, 'bytes_sent', 0) + \
+            int(request.headers.get('Content-Length', 0) or 0)
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0) if isinstance(parsed, dict) else 0
+        # The Content-Length of a HEAD response describes the object, not a body
+        bytes_received = 0 if model.http.get('method') == 'HEAD' else \
+            int(http_response.headers.get('Content-Length', 0) or 0)
+        self._record(model, context, str(http_response.status_code), retries, bytes_received)
+
+    def _after_call_error(self, context, exception, **kwargs):
+        model = context.get('instrumentation_model')
+        if model is not None:
+            self._record(model, context, type(exception).__name__, 0, 0)
+
+    def _record(self, model, context, status, retries, bytes_received):
+        start = context.get('instrumentation_start')
+        if start is None:
+            return
+        latency = time.perf_counter() - start
+        bytes_sent = getattr(self._local, 'bytes_sent', 0)
+        self._local.bytes_sent = 0
+        key = (model.service_model.service_id.hyphenize(), model.name)
+        with self._lock:
+            metrics = self._operations.get(key)
+            if metrics is None:
+                metrics = self._operations[key] = OperationMetrics()
+            metrics.observe(latency, status, retries, bytes_sent, bytes_received)
+
+    #########################################################
+    # Output
+    #########################################################
+
+    def get_snapshot(self):
+        """Return the metrics of every operation as a JSON-serializable dict
+
+        :return: dict keyed by 'service.Operation' with counts, latency percentiles, retries,
+        bytes and status counts
+        """
+
+        with self._lock:
+            snapshot = {}
+            for (service, operation), metrics in sorted(self._operations.items()):
+                snapshot[f"{service}.{operation}"] = {
+                    'count': metrics.count,
+                    'latency_seconds_sum': metrics.latency_sum,
+                    'latency_seconds_mean': metrics.latency_sum / metrics.count if metrics.count else None,
+                    'latency_seconds_p50': metrics.percentile(0.50),
+                    'latency_seconds_p90': metrics.percentile(0.90),
+                    'latency_seconds_p99': metrics.percentile(0.99),
+                    'retries': metrics.retries,
+                    'bytes_sent': metrics.bytes_sent,
+                    'bytes_received': metrics.bytes_received,
+                    'status_counts': dict(metrics.status_counts),
+                }
+            return snapshot
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format
+
+        :return: string
+        """
+
+        lines = [
+            "# HELP aws_api_call_duration_seconds Latency of AWS API calls, retries included.",
+            "# TYPE aws_api_call_duration_seconds histogram",
+        ]
+        with self._lock:
+            operations = sorted(self._operations.items())
+            for (service, operation), metrics in operations:
+                labels = f'service="{service}",operation="{operation}"'
+                cumulative = 0
+                for upper_bound, count in zip(LATENCY_BUCKETS, metrics.bucket_counts):
+                    cumulative += count
+                    le = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+                    lines.append(f'aws_api_call_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f'aws_api_call_duration_seconds_sum{{{labels}}} {metrics.latency_sum}')
+                lines.append(f'aws_api_call_duration_seconds_count{{{labels}}} {metrics.count}')
+
+            counters = [
+                ('aws_api_call_retries_total', 'Retries of AWS API calls.', 'retries'),
+                ('aws_api_bytes_sent_total', 'Request bytes sent to AWS.', 'bytes_sent'),
+                ('aws_api_bytes_received_total', 'Response bytes announced by AWS.', 'bytes_received'),
+            ]
+            for name, description, attribute in counters:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+                for (service, operation), metrics in operations:
+                    lines.append(f'{name}{{service="{service}",operation="{operation}"}} '
+                                 f'{getattr(metrics, attribute)}')
+
+            lines += ["# HELP aws_api_responses_total AWS API calls by HTTP status or exception.",
+                      "# TYPE aws_api_responses_total counter"]
+            for (service, operation), metrics in operations:
+                for status, count in sorted(metrics.status_counts.items()):
+                    lines.append(f'aws_api_responses_total{{service="{service}",operation="{operation}",'
+                                 f'status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Forget every recorded call"""
+        with self._lock:
+            self._operations.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    """Return the registry shared by the process"""
+    return _registry
+
+
+def instrument_client(client):
+    """Record the calls of a client in the shared registry
+
+    :param client: boto3 client of any service, e.g., S3, Glue or Athena
+    :return: The same client, for chaining
+    """
+
+    _registry.instrument(client)
+    return client
+
+
+def write_prometheus(path):
+    """Write the shared metrics as a Prometheus text file, replacing it atomically
+
+    :param path: string, e.g., '/var/lib/node_exporter/textfile/s3.prom'
+    """
+
+    write_atomically(path, _registry.to_prometheus())
+
+
+def write_json_snapshot(path):
+    """Write the shared metrics as a JSON snapshot, replacing it atomically
+
+    :param path: string
+    """
+
+    write_atomically(path, json.dumps(_registry.get_snapshot(), indent=4))
+
+
+def write_metrics(path):
+    """Write the shared metrics as a Prometheus text file if the path ends with '.prom', else as JSON
+
+    :param path: string
+    """
+
+    if path.endswith('.prom'):
+        write_prometheus(path)
+    else:
+        write_json_snapshot(path)
@@ -0,0 +1,277 @@
+""" ETag-keyed local read-through cache of S3 objects.
+
+Every read goes through a conditional GetObject carrying If-None-Match with the ETag of
+the cached copy: an unchanged object costs a bodiless 304 response and is served from
+disk, while a changed or unknown object is downloaded and cached. The cache is bounded
+by a disk budget, evicting the least recently used objects first, and keeps hit, miss
+and bytes-saved counters. Objects being copied or opened are pinned, so a concurrent
+miss never evicts them mid-read. The index is persisted every INDEX_SAVE_INTERVAL
+downloads and on save().
+
+Usage:
+    set_object_cache(ObjectCache("./.s3_cache", max_bytes=10 * 1024 ** 3))
+    download_objects_from_bucket(...)  # now served through the cache
+    print(get_object_cache().get_stats())
+"""
+
+#%%
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from botocore.exceptions import ClientError
+from file_utils import write_atomically
+
+
+class ObjectCache:
+    """Read-through cache of S3 objects stored under a local directory
+
+    :param directory: Directory holding the cached objects and the cache index
+    :param max_bytes: Disk budget; least recently used objects are evicted above it
+    """
+
+    INDEX_NAME = "index.json"
+    INDEX_SAVE_INTERVAL = 100
+
+    def __init__(self, directory, max_bytes=10 * 1024 ** 3):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pins = Counter()
+        self._unsaved = 0
+        self._total_bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'bytes_downloaded': 0, 'evictions': 0}
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    #########################################################
+    # Index
+    #########################################################
+
+    def _load_index(self):
+        index_path = os.path.join(self.directory, self.INDEX_NAME)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            entries = json.load(f)
+        for entry in sorted(entries, key=lambda entry: entry['last_access']):
+            if os.path.exists(self._path(entry['bucket'], entry['key'])):
+                self._entries[(entry['bucket'], entry['key'])] = entry
+                self._total_bytes += entry['size']
+        # Objects downloaded after the last save of a previous process are not indexed
+        indexed = {os.path.basename(self._path(*cache_key)) for cache_key in self._entries}
+        for name in os.listdir(self.directory):
+            if len(name) == 64 and name not in indexed:
+                os.remove(os.path.join(self.directory, name))
+
+    def _save_index(self):
+        """Persist the index atomically; must be called without the lock held"""
+        with self._save_lock:
+            with self._lock:
+                entries = [dict(entry) for entry in self._entries.values()]
+                self._unsaved = 0
+            write_atomically(os.path.join(self.directory, self.INDEX_NAME), json.dumps(entries))
+
+    def _path(self, bucket, key):
+        return os.path.join(self.directory, hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest())
+
+    def _evict(self):
+        """Drop least recently used, unpinned entries until the budget is met; must be called with the lock held"""
+        for cache_key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if self._pins[cache_key]:
+                continue
+            entry = self._entries.pop(cache_key)
+            self._total_bytes -= entry['size']
+            self._stats['evictions'] += 1
+            try:
+                os.remove(self._path(*cache_key))
+            except OSError:
+                pass
+
+    #########################################################
+    # Reads
+    #########################################################
+
+    @contextmanager
+    def pinned(self, client, bucket, key):
+        """Context manager yielding the path of an up-to-date local copy of an object, which is
+        not evicted until the context exits
+
+        :param client: S3 Client used to connect with AWS
+        :param bucket: string
+        :param key: string
+        :return: Path of the cached file (do not modify it)
+        """
+
+        cache_key = (bucket, key)
+        path = self._fetch_pinned(client, bucket, key)
+        try:
+            yield path
+        finally:
+            with self._lock:
+                self._pins[cache_key] -= 1
+                if not self._pins[cache_key]:
+                    del self._pins[cache_key]
+
+    def _fetch_pinned(self, client, bucket, key):
+        """Make the local copy of an object up to date and pin it; the caller must unpin it"""
+        cache_key = (bucket, key)
+        path = self._path(bucket, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+
+        kwargs = {'Bucket': bucket, 'Key': key}
+        if entry is not None:
+            kwargs['IfNoneMatch'] = entry['etag']
+        try:
+            response = client.get_object(**kwargs)
+        except ClientError as e:
+            if entry is None or e.response['Error']['Code'] not in ('304', 'NotModified'):
+                raise
+            with self._lock:
+                # The entry may have been evicted (or replaced) while the request was in flight
+                if self._entries.get(cache_key) is entry:
+                    entry['last_access'] = time.time()
+                    self._entries.move_to_end(cache_key)
+                    self._pins[cache_key] += 1
+                    self._stats['hits'] += 1
+                    self._stats['bytes_saved'] += entry['size']
+                    return path
+            return self._fetch_pinned(client, bucket, key)
+
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(response['Body'], f, 1024 * 1024)
+            size = os.path.getsize(temp_name)
+            with self._lock:
+                os.replace(temp_name, path)
+                previous = self._entries.pop(cache_key, None)
+                if previous is not None:
+                    self._total_bytes -= previous['size']
+                self._entries[cache_key] = {'bucket': bucket, 'key': key, 'etag': response['ETag'],
+                                            'size': size, 'last_access': time.time()}
+                self._total_bytes += size
+                self._pins[cache_key] += 1
+                self._stats['misses'] += 1
+                self._stats['bytes_downloaded'] += size
+                self._evict()
+                self._unsaved += 1
+                save = self._unsaved >= self.INDEX_SAVE_INTERVAL
+        finally:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+        if save:
+            try:
+                self._save_index()
+            except OSError as e:
+                logging.error(e)
+        return path
+
+    def fetch(self, client, bucket, key):
+        """Return the path of an up-to-date local copy of an object, downloading it only if it changed
+
+        The file is not pinned once this returns, so a concurrent miss may evict it; use
+        copy_to, open or pinned when other threads share the cache.
+
+        :param client: S3 Client used to connect with AWS
+        :param bucket: string
+        :param key: string
+        :return: Path of the cached file (do not modify it; use copy_to for a private copy)
+        """
+
+        with self.pinned(client, bucket, key) as path:
+            return path
+
+    def copy_to(self, client, bucket, key, file_name):
+        """Place an up-to-date copy of an object at file_name, served from the cache when unchanged
+
+        :param client: S3 Client used to connect with AWS
+        :param bucket: string
+        :param key: string
+        :param file_name: Local destination path
+        :return: Size of the object in bytes
+        """
+
+        with self.pinned(client, bucket, key) as path:
+            shutil.copyfile(path, file_name)
+        return os.path.getsize(file_name)
+
+    def open(self, client, bucket, key):
+        """Open an up-to-date copy of an object for binary reading
+
+        The file is opened while pinned, so the returned file object stays readable even if
+        the entry is evicted afterwards.
+
+        :param client: S3 Client used to connect with AWS
+        :param bucket: string
+        :param key: string
+        :return: Binary file object
+        """
+
+        with self.pinned(client, bucket, key) as path:
+            return open(path, 'rb')
+
+    #########################################################
+    # Maintenance
+    #########################################################
+
+    def get_stats(self):
+        """Return the cache counters
+
+        :return: dict with 'hits', 'misses', 'hit_ratio', 'bytes_saved', 'bytes_downloaded',
+        'evictions', 'objects' and 'bytes'
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['objects'] = len(self._entries)
+            stats['bytes'] = self._total_bytes
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / requests if requests else 0.0
+        return stats
+
+    def save(self):
+        """Persist the index, with the access order of the cached objects"""
+        self._save_index()
+
+    def clear(self):
+        """Remove every cached object"""
+        with self._lock:
+            for cache_key in self._entries:
+                try:
+                    os.remove(self._path(*cache_key))
+                except FileNotFoundError:
+                    pass
+            self._entries.clear()
+            self._total_bytes = 0
+        self._save_index()
+        logging.info(f"Cleared object cache at '{self.directory}'.")
+
+
+_object_cache = None
+
+
+def get_object_cache():
+    """Return the cache shared by the process, or None if caching is disabled"""
+    return _object_cache
+
+
+def set_object_cache(cache):
+    """Replace the cache shared by the process; None disables caching
+
+    :param cache: ObjectCache or None
+    """
+
+    global _object_cache
+    _object_cache = cache
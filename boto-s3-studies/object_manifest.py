@@ -0,0 +1,238 @@
+""" Local SQLite manifest of the objects stored in S3 buckets.
+
+The manifest keeps the key, size, ETag and LastModified of every listed object, so that
+existence checks, diffs and size reports can be answered locally instead of issuing a
+full list_objects_v2 listing each time. It is refreshed incrementally, either by
+re-listing only the prefixes known to have changed or by listing only the keys that sort
+after the newest key already recorded.
+"""
+
+#%%
+import logging
+import sqlite3
+import time
+from functional_low_level import iter_objects_in_bucket
+
+
+# Sorts after every valid character, so [prefix, prefix + _PREFIX_END) covers all keys under prefix
+_PREFIX_END = '\U0010ffff'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (bucket, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS refreshes (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+) WITHOUT ROWID;
+"""
+
+
+#########################################################
+# Connection
+#########################################################
+
+def open_object_manifest(path="object_manifest.sqlite3"):
+    """Open (creating it if needed) a local object manifest
+
+    :param path: Path of the SQLite database file, or ':memory:'
+    :return: sqlite3 Connection to the manifest
+    """
+
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _key_range(prefix):
+    """Return the SQL condition and parameters selecting the keys under a prefix"""
+    if not prefix:
+        return "", ()
+    return " AND key >= ? AND key < ?", (prefix, prefix + _PREFIX_END)
+
+
+def _to_row(bucket_name, content):
+    """Convert a list_objects_v2 content dict into a manifest row"""
+    last_modified = content.get('LastModified')
+    if last_modified is not None and not isinstance(last_modified, str):
+        last_modified = last_modified.isoformat()
+    return (bucket_name, content['Key'], content.get('Size', 0), content.get('ETag'), last_modified)
+
+
+#########################################################
+# Refresh
+#########################################################
+
+def refresh_object_manifest(conn, client, bucket_name, prefixes=None, start_after_newest=False):
+    """Refresh the manifest of a bucket from a remote listing
+
+    By default every prefix in prefixes (or the whole bucket) is re-listed and its rows are
+    replaced, which also drops deleted objects. With start_after_newest=True only the keys
+    sorting after the newest key recorded under each prefix are listed and added; this is
+    the cheapest refresh for append-only layouts such as date-partitioned keys.
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param client: S3 Client used to connect with AWS
+    :param bucket_name: Bucket to refresh
+    :param prefixes: List of prefixes that changed. If not specified, the whole bucket is refreshed
+    :param start_after_newest: If True, only list keys after the newest key already recorded
+    :return: Number of objects listed from S3
+    """
+
+    listed = 0
+    for prefix in prefixes or ['']:
+        condition, params = _key_range(prefix)
+        start_after = None
+        if start_after_newest:
+            row = conn.execute(
+                "SELECT MAX(key) FROM objects WHERE bucket = ?" + condition, (bucket_name, *params)
+            ).fetchone()
+            start_after = row[0]
+
+        contents = iter_objects_in_bucket(client, bucket_name, prefix=prefix or None, start_after=start_after)
+        rows = [0]
+
+        def to_rows():
+            for content in contents:
+                rows[0] += 1
+                yield _to_row(bucket_name, content)
+
+        with conn:
+            if start_after is None:
+                conn.execute("DELETE FROM objects WHERE bucket = ?" + condition, (bucket_name, *params))
+            conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", to_rows())
+            conn.execute("INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?)", (bucket_name, prefix, time.time()))
+        listed += rows[0]
+        logging.info(f"Refreshed manifest of '{bucket_name}' under prefix '{prefix}' ({rows[0]} objects listed).")
+    return listed
+
+
+def get_stale_prefixes(conn, bucket_name, max_age):
+    """Retrieve the prefixes of a bucket that were not refreshed recently
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param bucket_name: string
+    :param max_age: Maximum age, in seconds, of a refresh to be considered fresh
+    :return: List of prefixes refreshed more than max_age seconds ago
+    """
+
+    rows = conn.execute(
+        "SELECT prefix FROM refreshes WHERE bucket = ? AND refreshed_at < ?", (bucket_name, time.time() - max_age)
+    )
+    return [prefix for (prefix,) in rows]
+
+
+def record_objects(conn, bucket_name, contents):
+    """Record objects written by this process without listing the bucket again
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param bucket_name: string
+    :param contents: Iterable of dicts with at least Key and Size (ETag and LastModified optional)
+    """
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                         (_to_row(bucket_name, content) for content in contents))
+
+
+def forget_objects(conn, bucket_name, object_list):
+    """Remove objects deleted by this process from the manifest
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param bucket_name: string
+    :param object_list: Iterable of keys
+    """
+
+    with conn:
+        conn.executemany("DELETE FROM objects WHERE bucket = ? AND key = ?",
+                         ((bucket_name, key) for key in object_list))
+
+
+#########################################################
+# Queries
+#########################################################
+
+def manifest_object_exists(conn, bucket_name, key):
+    """Check if an object is recorded in the manifest
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param bucket_name: string
+    :param key: string
+    :return: True if the object is in the manifest, else False
+    """
+
+    row = conn.execute("SELECT 1 FROM objects WHERE bucket = ? AND key = ?", (bucket_name, key)).fetchone()
+    return row is not None
+
+
+def get_manifest_objects(conn, bucket_name, prefix=None):
+    """Retrieve the objects recorded in the manifest, in key order
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param bucket_name: string
+    :param prefix: Only retrieve keys beginning with this prefix
+    :return: Generator of dicts with Key, Size, ETag and LastModified
+    """
+
+    condition, params = _key_range(prefix)
+    rows = conn.execute(
+        "SELECT key, size, etag, last_modified FROM objects WHERE bucket = ?" + condition + " ORDER BY key",
+        (bucket_name, *params))
+    for key, size, etag, last_modified in rows:
+        yield {'Key': key, 'Size': size, 'ETag': etag, 'LastModified': last_modified}
+
+
+def diff_manifest(conn, bucket_name, local_objects, prefix=None):
+    """Compare local objects against the manifest of a bucket
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param bucket_name: string
+    :param local_objects: dict mapping object keys to their local size in bytes
+    :param prefix: Only compare keys beginning with this prefix
+    :return: dict with the sorted 'new', 'changed' and 'missing' key lists
+    """
+
+    changed, missing = [], []
+    seen = set()
+    for content in get_manifest_objects(conn, bucket_name, prefix=prefix):
+        key = content['Key']
+        if key not in local_objects:
+            missing.append(key)
+            continue
+        seen.add(key)
+        if local_objects[key] != content['Size']:
+            changed.append(key)
+    new = sorted(key for key in local_objects if key not in seen)
+    return {'new': new, 'changed': changed, 'missing': missing}
+
+
+def get_manifest_size_report(conn, bucket_name, prefix=None, delimiter='/'):
+    """Summarize the number of objects and bytes stored under each prefix
+
+    :param conn: Manifest connection returned by open_object_manifest
+    :param bucket_name: string
+    :param prefix: Prefix to summarize the children of
+    :param delimiter: Character separating prefix levels
+    :return: dict mapping each child prefix ('' for objects directly under prefix)
+    to a dict with 'objects' and 'bytes'
+    """
+
+    prefix = prefix or ''
+    condition, params = _key_range(prefix)
+    rows = conn.execute(
+        "SELECT CASE WHEN instr(rest, ?) > 0 THEN substr(rest, 1, instr(rest, ?)) ELSE '' END AS child,"
+        " COUNT(*), SUM(size)"
+        " FROM (SELECT substr(key, ?) AS rest, size FROM objects WHERE bucket = ?" + condition + ")"
+        " GROUP BY child ORDER BY child",
+        (delimiter, delimiter, len(prefix) + 1, bucket_name, *params))
+    return {prefix + child: {'objects': count, 'bytes': total or 0} for child, count, total in rows}
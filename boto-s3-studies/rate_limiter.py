@@ -0,0 +1,268 @@
+""" Token-bucket limiter shared by every S3 transfer of the process.
+
+It throttles the bytes per second sent and received by all transfers together, and the
+requests per second sent to each key prefix (S3 scales, and returns 503 SlowDown, per
+prefix). Limits can be changed at runtime, and the time spent waiting for tokens is kept
+in counters so throttling can be told apart from slow transfers.
+
+Requests and bytes are charged through the botocore events of the clients the limiter is
+registered on, so every call is covered: managed transfers and their parts, plain
+PutObject and GetObject calls, ranged GETs and retries. Each HTTP attempt is charged as
+a request on the bucket and prefix it targets (a DeleteObjects batch once per key, on
+the prefix of each key) and with the bytes of its body; the body of each response is
+charged when the call returns, before the caller reads it. Clients from client_factory
+are registered automatically.
+
+Usage:
+    configure_rate_limits(bytes_per_second=50 * 1024 ** 2, requests_per_second=1000)
+    register_rate_limiter(s3_client)  # not needed for clients from client_factory.get_client
+    ...
+    print(get_rate_limiter().get_counters())
+"""
+
+#%%
+import threading
+import time
+from collections import Counter
+
+
+#########################################################
+# Token Bucket
+#########################################################
+
+class TokenBucket:
+    """Blocking token bucket: tokens refill at `rate` per second up to `capacity`
+
+    A request larger than the available tokens is granted immediately and leaves the
+    bucket in debt, so the callers that come after it wait for the debt to be repaid.
+    This keeps the average rate exact without splitting large requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def set_rate(self, rate, capacity=None):
+        """Change the refill rate (and capacity) of the bucket
+
+        :param rate: Tokens per second
+        :param capacity: Maximum tokens accumulated while idle. If not specified, one second worth
+        """
+
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = capacity or rate
+            self._tokens = min(self._tokens, self.capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """Take tokens from the bucket, sleeping until they are available
+
+        :param amount: Number of tokens to take
+        :return: Seconds spent waiting
+        """
+
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+#########################################################
+# S3 Rate Limiter
+#########################################################
+
+class S3RateLimiter:
+    """Bandwidth limit shared by all transfers plus a request rate limit per key prefix
+
+    :param bytes_per_second: Total bytes per second, or None for no limit
+    :param requests_per_second: Requests per second allowed on each prefix, or None for no limit
+    :param prefix_depth: Number of '/'-separated key levels that make up a prefix
+    """
+
+    def __init__(self, bytes_per_second=None, requests_per_second=None, prefix_depth=1):
+        self._lock = threading.Lock()
+        self.prefix_depth = prefix_depth
+        self.bytes_per_second = None
+        self.requests_per_second = None
+        self._bytes_bucket = None
+        self._prefix_buckets = {}
+        self._counters = {'bytes': 0, 'requests': 0, 'bytes_throttled_seconds': 0.0,
+                          'requests_throttled_seconds': 0.0}
+        self.configure(bytes_per_second=bytes_per_second, requests_per_second=requests_per_second)
+
+    def configure(self, bytes_per_second=None, requests_per_second=None):
+        """Change the limits at runtime; transfers in progress pick them up on their next request
+
+        :param bytes_per_second: Total bytes per second, or None for no limit
+        :param requests_per_second: Requests per second allowed on each prefix, or None for no limit
+        """
+
+        with self._lock:
+            self.bytes_per_second = bytes_per_second
+            if not bytes_per_second:
+                self._bytes_bucket = None
+            elif self._bytes_bucket is None:
+                self._bytes_bucket = TokenBucket(bytes_per_second)
+            else:
+                self._bytes_bucket.set_rate(bytes_per_second)
+
+            self.requests_per_second = requests_per_second
+            if not requests_per_second:
+                self._prefix_buckets.clear()
+            for bucket in self._prefix_buckets.values():
+                bucket.set_rate(requests_per_second)
+
+    def get_prefix(self, key):
+        """Return the prefix a key is accounted under, e.g., 'ticker=AAPL/' for depth 1"""
+        parts = (key or '').split('/')
+        if len(parts) <= self.prefix_depth:
+            return ''
+        return '/'.join(parts[:self.prefix_depth]) + '/'
+
+    def throttle_bytes(self, amount):
+        """Account for transferred bytes, sleeping if the bandwidth limit is exceeded
+
+        Its signature matches the Callback argument of the boto3 managed transfers, for
+        clients the limiter is not registered on. The negative amounts s3transfer reports to
+        roll progress back before a retry are ignored: the retried bytes do cross the network again.
+
+        :param amount: Number of bytes sent or received
+        """
+
+        if amount <= 0:
+            return
+        bucket = self._bytes_bucket
+        waited = bucket.acquire(amount) if bucket is not None else 0.0
+        with self._lock:
+            self._counters['bytes'] += amount
+            self._counters['bytes_throttled_seconds'] += waited
+
+    def throttle_request(self, key=None, bucket_name=None, count=1):
+        """Account for requests on a key, sleeping if its prefix exceeds the request rate
+
+        :param key: Object key (or prefix) the request targets, or None for bucket-level requests
+        :param bucket_name: Bucket the request targets; prefixes of different buckets are limited apart
+        :param count: Number of requests charged, e.g., the keys of a DeleteObjects batch
+        """
+
+        with self._lock:
+            bucket = None
+            if self.requests_per_second:
+                prefix = (bucket_name or '', self.get_prefix(key))
+                bucket = self._prefix_buckets.get(prefix)
+                if bucket is None:
+                    bucket = self._prefix_buckets[prefix] = TokenBucket(self.requests_per_second)
+        waited = bucket.acquire(count) if bucket is not None else 0.0
+        with self._lock:
+            self._counters['requests'] += count
+            self._counters['requests_throttled_seconds'] += waited
+
+    def get_counters(self):
+        """Return a snapshot of the transferred bytes, requests and time spent throttled
+
+        :return: dict with 'bytes', 'requests', 'bytes_throttled_seconds' and 'requests_throttled_seconds'
+        """
+
+        with self._lock:
+            return dict(self._counters)
+
+
+_rate_limiter = None
+_local = threading.local()
+
+
+def get_rate_limiter():
+    """Return the limiter shared by the process, or None if no limits were configured"""
+    return _rate_limiter
+
+
+def set_rate_limiter(limiter):
+    """Replace the limiter shared by the process; None disables rate limiting
+
+    :param limiter: S3RateLimiter or None
+    """
+
+    global _rate_limiter
+    _rate_limiter = limiter
+
+
+def configure_rate_limits(bytes_per_second=None, requests_per_second=None, prefix_depth=1):
+    """Set the limits of the shared limiter, creating it on first use
+
+    :param bytes_per_second: Total bytes per second, or None for no limit
+    :param requests_per_second: Requests per second allowed on each prefix, or None for no limit
+    :param prefix_depth: Number of '/'-separated key levels that make up a prefix
+    :return: The shared S3RateLimiter
+    """
+
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = S3RateLimiter(bytes_per_second, requests_per_second, prefix_depth)
+    else:
+        _rate_limiter.prefix_depth = prefix_depth
+        _rate_limiter.configure(bytes_per_second=bytes_per_second, requests_per_second=requests_per_second)
+    return _rate_limiter
+
+
+#########################################################
+# Client Events
+#########################################################
+
+def _before_parameter_build(params, **kwargs):
+    if 'Delete' in params:
+        keys = [item['Key'] for item in params['Delete'].get('Objects', [])]
+    else:
+        keys = [params.get('Key') or params.get('Prefix')]
+    _local.request = (params.get('Bucket'), keys)
+
+
+def _before_send(request, **kwargs):
+    # Called once per attempt, so retries and their bodies are charged too
+    limiter = _rate_limiter
+    if limiter is None:
+        return None
+    call = getattr(_local, 'request', None)
+    if call is not None:
+        bucket_name, keys = call
+        for prefix, count in Counter(limiter.get_prefix(key) for key in keys).items():
+            limiter.throttle_request(prefix, bucket_name=bucket_name, count=count)
+    limiter.throttle_bytes(int(request.headers.get('Content-Length', 0) or 0))
+    return None
+
+
+def _after_call(http_response, model, **kwargs):
+    # The Content-Length of a HEAD response describes the object, not a body
+    limiter = _rate_limiter
+    if limiter is None or model.http.get('method') == 'HEAD':
+        return
+    limiter.throttle_bytes(int(http_response.headers.get('Content-Length', 0) or 0))
+
+
+def register_rate_limiter(client):
+    """Charge every HTTP attempt of an S3 client, and the bytes it transfers, to the shared limiter
+
+    The handlers look the shared limiter up on each request, so limits configured (or
+    removed) later apply to the client too. Registering a client twice has no effect.
+
+    :param client: boto3 S3 client
+    :return: The same client, for chaining
+    """
+
+    events = client.meta.events
+    events.register('before-parameter-build.s3', _before_parameter_build,
+                    unique_id='rate-limiter-before-parameter-build')
+    events.register('before-send.s3', _before_send, unique_id='rate-limiter-before-send')
+    events.register('after-call.s3', _after_call, unique_id='rate-limiter-after-call')
+    return client